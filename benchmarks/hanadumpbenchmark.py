@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+import sys, os, time, json, tempfile, shutil, multiprocessing, subprocess
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hanadumpviewer
+try:
+    import resource
+except ImportError:
+    resource = None   # e.g. on Windows, then no peak memory is reported
+
+def printHelp():
+    print("                                                                                                                               ")
+    print("DESCRIPTION:                                                                                                                   ")
+    print(" The HANA Dump Benchmark times each stage of hanadumpviewer.py separately on a trace file (e.g. one written by                ")
+    print(" hanadumpgenerator.py) and reports wall time, throughput and peak memory per stage. Every stage runs in its own process, so   ")
+    print(" the peak memory of one stage is not hidden by an earlier stage.                                                             ")
+    print("                                                                                                                               ")
+    print("STAGES:                                                                                                                        ")
+    print(" readSectionLines  read the [STACK_SHORT] section into a list of lines                                                        ")
+    print(" createThreads     parse the stack lines into threads                                                                         ")
+    print(" splitStackLine    normalize every stack line (with an empty frame cache)                                                      ")
+    print(" createDotLines    build the stack graph from the threads                                                                     ")
+    print(" writeDotFile      write the .dot file of the stack graph                                                                     ")
+    print(" makeViews         write the views of the [STATISTICS] section as .csv files                                                  ")
+    print(" pipeline          the whole streaming pipeline of hanadumpviewer.py (-md true -mw true -mv true)                             ")
+    print("                                                                                                                               ")
+    print("INPUT ARGUMENTS:                                                                                                               ")
+    print(" -df     dump file, full path of the trace file to benchmark                                                                   ")
+    print(" -st     stages, list of stages, seperated by only a comma, default: all stages                                               ")
+    print(" -rp     repetitions [int], every stage is run this many times, the fastest run is reported, default: 1                       ")
+    print(" -pt     plot threads [true/false], as in hanadumpviewer.py, default: false                                                   ")
+    print(" -fl     function length [int], as in hanadumpviewer.py, default: -1                                                          ")
+    print(" -if     id by function [true/false], as in hanadumpviewer.py, default: true                                                  ")
+    print(" -rh     remove hex [true/false], as in hanadumpviewer.py, default: true                                                      ")
+    print(" -oj     output json, full path of a .json file that the results are written to, so that versions can be compared,           ")
+    print("         default: '' (not used)                                                                                                ")
+    print("                                                                                                                               ")
+    print("EXAMPLE:                                                                                                                       ")
+    print("  > python hanadumpgenerator.py -of /tmp/indexserver_big.rtedump.trc -sz 1024                                                 ")
+    print("  > python hanadumpbenchmark.py -df /tmp/indexserver_big.rtedump.trc -rp 3 -oj /tmp/benchmark.json                           ")
+    print("                                                                                                                               ")
+    os._exit(1)
+
+STAGES = ['readSectionLines', 'createThreads', 'splitStackLine', 'createDotLines', 'writeDotFile', 'makeViews', 'pipeline']
+
+######################## DEFINE FUNCTIONS ################################
+
+def peakMemoryMB(who = 'self'):
+    if resource is None:
+        return -1.0
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if who == 'children' else resource.RUSAGE_SELF).ru_maxrss
+    return peak/1024.0/1024.0 if sys.platform == 'darwin' else peak/1024.0   # bytes on macOS, KB on Linux
+
+def runStage(stage, dumpfile, settings, out_dir):
+    # prepares the input of the stage (not timed) and then times the stage, returns [seconds, input bytes, frames, peak MB before, peak MB after]
+    [plot_threads, functionLength, id_by_function, removeHexFromFunction] = settings
+    hanadumpviewer.frameCache.entries.clear()
+    stackLines = threads = dotLines = statLines = None
+    if stage in ['createThreads', 'splitStackLine', 'createDotLines', 'writeDotFile']:
+        stackLines = hanadumpviewer.readSectionLines(dumpfile, '[STACK_SHORT]')
+    if stage in ['createDotLines', 'writeDotFile']:
+        threads = hanadumpviewer.createThreads(stackLines)[0]
+    if stage == 'writeDotFile':
+        [dotLines, maxNbrThreads] = hanadumpviewer.createDotLines(threads, plot_threads, functionLength, removeHexFromFunction, id_by_function)
+        hanadumpviewer.frameCache.entries.clear()
+    if stage == 'makeViews':
+        statLines = hanadumpviewer.readSectionLines(dumpfile, '[STATISTICS]')
+    if stage in ['createDotLines', 'writeDotFile']:
+        stackLines = None   # only the threads are needed from here on
+    memoryBefore = peakMemoryMB()
+    nFrames = 0
+    nBytes = 0
+    start = time.time()
+    if stage == 'readSectionLines':
+        stackLines = hanadumpviewer.readSectionLines(dumpfile, '[STACK_SHORT]')
+        nBytes = sum([len(line) for line in stackLines])
+        nFrames = len(stackLines)
+    elif stage == 'createThreads':
+        threads = hanadumpviewer.createThreads(stackLines)[0]
+        nBytes = sum([len(line) for line in stackLines])
+        nFrames = sum([len(thread.frameIds) for thread in threads])
+    elif stage == 'splitStackLine':
+        for line in stackLines:
+            if ' in ' in line and not '[thr=' in line and not 'Allocation failed' in line:
+                hanadumpviewer.splitStackLine(line, functionLength, removeHexFromFunction)
+                nFrames += 1
+                nBytes += len(line)
+    elif stage == 'createDotLines':
+        hanadumpviewer.createDotLines(threads, plot_threads, functionLength, removeHexFromFunction, id_by_function)
+        nFrames = sum([len(thread.frameIds) for thread in threads])
+    elif stage == 'writeDotFile':
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            hanadumpviewer.writeDotFile(dotLines, maxNbrThreads, plot_threads, False, 0, 0, dumpfile, out_dir)
+        finally:
+            sys.stdout = stdout
+        nBytes = os.path.getsize(os.path.join(out_dir, os.path.basename(dumpfile)+'.dot'))
+        nFrames = len(dotLines)
+    elif stage == 'makeViews':
+        hanadumpviewer.makeViews(dumpfile, statLines, out_dir)
+        nBytes = sum([len(line) for line in statLines])
+    elif stage == 'pipeline':   # runs hanadumpviewer.py as it is run by the users, its peak memory is the one of the child process
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call([sys.executable, hanadumpviewer.__file__.replace('.pyc', '.py'), '-df', dumpfile, '-mw', 'true', '-mv', 'true', '-si', 'false', '-od', out_dir,
+                                   '-pt', str(plot_threads).lower(), '-fl', str(functionLength), '-if', str(id_by_function).lower(), '-rh', str(removeHexFromFunction).lower()], stdout=devnull)
+        nBytes = os.path.getsize(dumpfile)
+        return [time.time() - start, nBytes, nFrames, 0.0, peakMemoryMB('children')]
+    seconds = time.time() - start
+    return [seconds, nBytes, nFrames, memoryBefore, peakMemoryMB()]
+
+def runStageInProcess(job):
+    # exceptions are returned as text, an exception that cannot be sent back to the main process would make the pool hang 
+    try:
+        return runStage(*job)
+    except Exception as e:
+        return "ERROR: "+repr(e)
+
+def checkAndConvertBooleanFlag(boolean, flagstring):
+    boolean = boolean.lower()
+    if boolean not in ("false", "true"):
+        print "INPUT ERROR: ", flagstring, " must be either 'true' or 'false'. Please see --help for more information."
+        os._exit(1)
+    return boolean == "true"
+
+def main():
+    #####################   DEFAULTS   ####################
+    dumpfile = ''
+    stages = STAGES
+    repetitions = '1'
+    plot_threads = 'false'
+    functionLength = '-1'
+    id_by_function = 'true'
+    removeHexFromFunction = 'true'
+    out_json = ''
+
+    #####################  CHECK INPUT ARGUMENTS #################
+    if len(sys.argv) == 1:
+        print "INPUT ERROR: hanadumpbenchmark needs input arguments. Please see --help for more information."
+        os._exit(1)
+    if len(sys.argv) != 2 and len(sys.argv) % 2 == 0:
+        print "INPUT ERROR: Wrong number of input arguments. Please see --help for more information."
+        os._exit(1)
+
+    #####################   INPUT ARGUMENTS   ####################
+    if '-h' in sys.argv or '--help' in sys.argv:
+        printHelp()
+    if '-df' in sys.argv:
+        dumpfile = sys.argv[sys.argv.index('-df') + 1]
+    if '-st' in sys.argv:
+        stages = sys.argv[sys.argv.index('-st') + 1].split(',')
+    if '-rp' in sys.argv:
+        repetitions = sys.argv[sys.argv.index('-rp') + 1]
+    if '-pt' in sys.argv:
+        plot_threads = sys.argv[sys.argv.index('-pt') + 1]
+    if '-fl' in sys.argv:
+        functionLength = sys.argv[sys.argv.index('-fl') + 1]
+    if '-if' in sys.argv:
+        id_by_function = sys.argv[sys.argv.index('-if') + 1]
+    if '-rh' in sys.argv:
+        removeHexFromFunction = sys.argv[sys.argv.index('-rh') + 1]
+    if '-oj' in sys.argv:
+        out_json = sys.argv[sys.argv.index('-oj') + 1]
+
+    ############ CHECK AND CONVERT INPUT PARAMETERS ################
+    if not dumpfile or not os.path.isfile(dumpfile):
+        print "INPUT ERROR: -df must be an existing trace file. Please see --help for more information."
+        os._exit(1)
+    for stage in stages:
+        if not stage in STAGES:
+            print "INPUT ERROR: unknown stage "+stage+" in -st. Please see --help for more information."
+            os._exit(1)
+    if not hanadumpviewer.is_integer(repetitions) or int(repetitions) < 1:
+        print "INPUT ERROR: -rp must be a positive integer. Please see --help for more information."
+        os._exit(1)
+    if not hanadumpviewer.is_integer(functionLength):
+        print "INPUT ERROR: -fl must be an integer. Please see --help for more information."
+        os._exit(1)
+    settings = [checkAndConvertBooleanFlag(plot_threads, "-pt"), int(functionLength), checkAndConvertBooleanFlag(id_by_function, "-if"), checkAndConvertBooleanFlag(removeHexFromFunction, "-rh")]
+
+    ################ START #################
+    out_dir = tempfile.mkdtemp(prefix='hanadumpbenchmark_')
+    results = []
+    try:
+        print "Benchmark of "+dumpfile+" ("+str(round(os.path.getsize(dumpfile)/1024.0/1024.0, 1))+" MB)\n"
+        print "%-18s %10s %10s %14s %16s" % ('STAGE', 'SECONDS', 'MB/S', 'FRAMES/S', 'PEAK MEMORY MB')
+        for stage in stages:
+            runs = []
+            for i in range(int(repetitions)):
+                pool = multiprocessing.Pool(1, maxtasksperchild=1)   # a fresh process, so that the peak memory belongs to this stage
+                try:
+                    runs.append(pool.apply(runStageInProcess, [[stage, dumpfile, settings, out_dir]]))
+                finally:
+                    pool.close()
+                    pool.join()
+            errors = [run for run in runs if isinstance(run, str)]
+            if errors:
+                print "%-18s %s" % (stage, errors[0])
+                continue
+            [seconds, nBytes, nFrames, memoryBefore, memoryAfter] = min(runs)
+            mbPerSecond = nBytes/1024.0/1024.0/seconds if seconds > 0 else 0.0
+            framesPerSecond = nFrames/seconds if seconds > 0 else 0.0
+            print "%-18s %10.3f %10.1f %14.0f %16.1f" % (stage, seconds, mbPerSecond, framesPerSecond, memoryAfter)
+            results.append({'stage':stage, 'seconds':seconds, 'bytes':nBytes, 'frames':nFrames, 'mb_per_second':mbPerSecond, 'frames_per_second':framesPerSecond,
+                            'peak_memory_mb':memoryAfter, 'peak_memory_growth_mb':memoryAfter - memoryBefore})
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    if out_json:
+        with open(out_json, 'w') as jsonfile:
+            json.dump({'dumpfile':dumpfile, 'size':os.path.getsize(dumpfile), 'settings':settings, 'repetitions':int(repetitions), 'stages':results}, jsonfile, indent=1)
+        print "\nFile "+out_json+" was created"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+import sys, os, random
+
+def printHelp():
+    print("                                                                                                                               ")
+    print("DESCRIPTION:                                                                                                                   ")
+    print(" The HANA Dump Generator writes synthetic indexserver trace files that look like SAP HANA runtime dumps, with the sections     ")
+    print(" [STACK_SHORT], [INDEXMANAGER_WAITGRAPH] and [STATISTICS], so that hanadumpviewer.py can be benchmarked on dumps of any size.  ")
+    print("                                                                                                                               ")
+    print("INPUT ARGUMENTS:                                                                                                               ")
+    print(" -of     output file, full path of the trace file that is written, default: 'indexserver_synthetic.rtedump.trc'              ")
+    print(" -nt     number threads [int], number of normal threads in the [STACK_SHORT] section, default: 1000                           ")
+    print(" -sd     stack depth [int], maximum number of stack lines per thread (each thread gets between half of it and it), default: 40  ")
+    print(" -fr     frame reuse ratio [float between 0 and 1], the probability that a stack frame is one that was already used by another ")
+    print("         thread, a high ratio gives few unique frames (small graph), a low ratio many unique frames (large graph), default: 0.9")
+    print(" -ne     number exception threads [int], number of 'Allocation failed' blocks in the [STACK_SHORT] section, default: 10       ")
+    print(" -nw     number wait graph edges [int], number of edges in the [INDEXMANAGER_WAITGRAPH] section, default: 100                  ")
+    print(" -nv     number views [int], number of views in the [STATISTICS] section, default: 20                                           ")
+    print(" -rv     rows per view [int], number of rows of each view in the [STATISTICS] section, default: 100                            ")
+    print(" -sz     size [int], if larger than 0 threads are written until the trace file is at least this many MB large (then -nt is    ")
+    print("         ignored), default: 0                                                                                                  ")
+    print(" -se     seed [int], seed of the random numbers, the same seed and arguments always give the same trace file, default: 1       ")
+    print("                                                                                                                               ")
+    print("EXAMPLE (a 2 GB dump with many unique frames):                                                                                 ")
+    print("  > python hanadumpgenerator.py -of /tmp/indexserver_big.rtedump.trc -sz 2048 -fr 0.5                                         ")
+    print("                                                                                                                               ")
+    os._exit(1)
+
+######################## DEFINE CLASSES ##################################
+class FrameGenerator:
+    # hands out stack frames, with probability frameReuseRatio a frame that was already handed out is reused
+    def __init__(self, frameReuseRatio, rand):
+        self.frameReuseRatio = frameReuseRatio
+        self.rand = rand
+        self.frames = []
+    def new_frame(self):
+        n = len(self.frames)
+        kind = n % 5
+        if kind == 0:
+            function = 'Namespace'+str(n % 97)+'::Class'+str(n)+'::method'+str(n % 13)+'(unsigned long, int)+0x'+format(self.rand.randint(1, 4095), 'x')+' at File'+str(n % 211)+'.cpp:'+str(n % 1000)+' (libhdb'+str(n % 7)+'.so)'
+        elif kind == 1:
+            function = '_ZN'+str(len('Namespace'))+'Namespace'+str(len('Class'+str(n)))+'Class'+str(n)+'3runERKv+0x'+format(self.rand.randint(1, 4095), 'x')+' (libhdbbasis.so)'
+        elif kind == 2:
+            function = 'ltt::vector<Class'+str(n)+', ltt::allocator>::push_back(Class'+str(n)+' const&)+0x'+format(self.rand.randint(1, 4095), 'x')+' at vector.hpp:'+str(n % 500)+' (libhdbbasis.so)'
+        elif kind == 3:
+            function = 'unsigned long Synchronization::Mutex'+str(n)+'::lock(Execution::Context&)+0x'+format(self.rand.randint(1, 4095), 'x')+' (libhdbbasis.so)'
+        else:
+            function = 'Execution::JobWorker'+str(n)+'::run(void*&)+0x'+format(self.rand.randint(1, 4095), 'x')+' at JobExecutor.cpp:'+str(n % 800)+' (libhdbbasis.so)'
+        frame = ['0x'+format(0x00007f0000000000 + 16*n, '016x'), function]
+        self.frames.append(frame)
+        return frame
+    def frame(self):
+        if self.frames and self.rand.random() < self.frameReuseRatio:
+            return self.frames[self.rand.randint(0, len(self.frames)-1)]
+        return self.new_frame()
+
+######################## DEFINE FUNCTIONS ################################
+
+def is_integer(s):
+    try:
+        int(s)
+        return True
+    except ValueError:
+        return False
+
+def is_number(s):
+    try:
+        float(s)
+        return True
+    except ValueError:
+        return False
+
+def stackText(frames):
+    return ''.join(['  '+str(i+1)+': '+frames[i][0]+' in '+frames[i][1]+'\n' for i in range(len(frames))])
+
+def threadText(threadId, frameGenerator, stackDepth, rand):
+    threadType = rand.choice(['JobWorker', 'SqlExecutor', 'Request', 'MergedogMonitor', 'LoadHistoryThread'])
+    frames = [frameGenerator.frame() for i in range(rand.randint(max(1, stackDepth // 2), stackDepth))]
+    return ('\n[thr='+str(threadId)+']: '+threadType+', TID: '+str(threadId % 3000)+', UTID: '+str(threadId*7)+', CID -1, LCID 0, parent: -1, SQLUserName: "", '
+            +'AppUserName: "", AppName: "", ConnCtx: 0x00007f1234560000, Type: "'+threadType+'" at\n'+stackText(frames)+'--\n')
+
+def exceptionText(frameGenerator, stackDepth, rand):
+    size = rand.randint(1, 1 << 30)
+    frames = [frameGenerator.frame() for i in range(rand.randint(max(1, stackDepth // 4), max(1, stackDepth // 2)))]
+    return ('Allocation failed ; $failure_type$=GLOBAL_ALLOCATION_LIMIT; $failure_flag$=; $size$='+str(size)+'; $name$=Pool/PersistenceManager; $type$=pool;\n'
+            +'exception throw location:\n'+stackText(frames)+'\n')
+
+def writeStackSection(dumpfile, nThreads, stackDepth, frameReuseRatio, nExceptThreads, minSize, rand):
+    frameGenerator = FrameGenerator(frameReuseRatio, rand)
+    dumpfile.write('[STACK_SHORT]  Short call stacks and pending exceptions of all threads: (2018-01-15 08:47:44 034 Local)\n')
+    threadId = 10000
+    while (minSize <= 0 and threadId - 10000 < nThreads) or (minSize > 0 and dumpfile.tell() < minSize):
+        dumpfile.write(threadText(threadId, frameGenerator, stackDepth, rand))
+        if threadId % 50 == 0:
+            dumpfile.write('\n[thr='+str(threadId+1)+']: inactive\n--\n')
+        threadId += 1
+    for i in range(nExceptThreads):
+        dumpfile.write(exceptionText(frameGenerator, stackDepth, rand))
+    dumpfile.write('[OK]\n--\n')
+
+def writeWaitGraphSection(dumpfile, nWaitEdges, rand):
+    dumpfile.write('[INDEXMANAGER_WAITGRAPH]  Wait graph of the index manager: (2018-01-15 08:47:44 034 Local)\n')
+    dumpfile.write('digraph WaitGraph {\n')
+    nTransactions = max(2, nWaitEdges)
+    for i in range(nWaitEdges):
+        waiter = rand.randint(1, nTransactions)
+        holder = rand.randint(1, max(1, nTransactions // 10))   # few transactions hold most of the locks
+        dumpfile.write('  "Transaction '+str(waiter)+'" -> "Transaction '+str(holder)+'" [label="exclusive lock on table '+str(rand.randint(1, 50))+'"];\n')
+    dumpfile.write('}\n[OK]\n--\n')
+
+def writeStatisticsSection(dumpfile, nViews, nRowsPerView, rand):
+    dumpfile.write('[STATISTICS]  Statistics data: (2018-01-15 08:47:44 034 Local)\n')
+    for i in range(nViews):
+        view = 'M_SYNTHETIC_VIEW_'+str(i)
+        dumpfile.write(view+' - synthetic monitoring view '+str(i)+'\n')
+        dumpfile.write('HOST,PORT,THREAD_ID,THREAD_TYPE,CPU_TIME,MEMORY_SIZE\n')
+        for j in range(nRowsPerView):
+            dumpfile.write('ls80010,30003,'+str(10000+j)+',JobWorker,'+str(rand.randint(0, 10**6))+','+str(round(rand.random()*1000, 2))+'\n')
+        dumpfile.write('('+view+','+str(nRowsPerView)+' rows)\n')
+    dumpfile.write('[OK]\n--\n')
+
+def main():
+    #####################   DEFAULTS   ####################
+    outfile = 'indexserver_synthetic.rtedump.trc'
+    nThreads = '1000'
+    stackDepth = '40'
+    frameReuseRatio = '0.9'
+    nExceptThreads = '10'
+    nWaitEdges = '100'
+    nViews = '20'
+    nRowsPerView = '100'
+    minSize = '0'
+    seed = '1'
+
+    #####################  CHECK INPUT ARGUMENTS #################
+    if len(sys.argv) != 2 and len(sys.argv) % 2 == 0:
+        print "INPUT ERROR: Wrong number of input arguments. Please see --help for more information."
+        os._exit(1)
+    for i in range(len(sys.argv)):
+        if i % 2 != 0:
+            if sys.argv[i][0] != '-':
+                print "INPUT ERROR: Every second argument has to be a flag, i.e. start with -. Please see --help for more information."
+                os._exit(1)
+
+    #####################   INPUT ARGUMENTS   ####################
+    if '-h' in sys.argv or '--help' in sys.argv:
+        printHelp()
+    if '-of' in sys.argv:
+        outfile = sys.argv[sys.argv.index('-of') + 1]
+    if '-nt' in sys.argv:
+        nThreads = sys.argv[sys.argv.index('-nt') + 1]
+    if '-sd' in sys.argv:
+        stackDepth = sys.argv[sys.argv.index('-sd') + 1]
+    if '-fr' in sys.argv:
+        frameReuseRatio = sys.argv[sys.argv.index('-fr') + 1]
+    if '-ne' in sys.argv:
+        nExceptThreads = sys.argv[sys.argv.index('-ne') + 1]
+    if '-nw' in sys.argv:
+        nWaitEdges = sys.argv[sys.argv.index('-nw') + 1]
+    if '-nv' in sys.argv:
+        nViews = sys.argv[sys.argv.index('-nv') + 1]
+    if '-rv' in sys.argv:
+        nRowsPerView = sys.argv[sys.argv.index('-rv') + 1]
+    if '-sz' in sys.argv:
+        minSize = sys.argv[sys.argv.index('-sz') + 1]
+    if '-se' in sys.argv:
+        seed = sys.argv[sys.argv.index('-se') + 1]
+
+    ############ CHECK AND CONVERT INPUT PARAMETERS ################
+    for [value, flag] in [[nThreads, '-nt'], [stackDepth, '-sd'], [nExceptThreads, '-ne'], [nWaitEdges, '-nw'], [nViews, '-nv'], [nRowsPerView, '-rv'], [minSize, '-sz'], [seed, '-se']]:
+        if not is_integer(value) or int(value) < 0:
+            print "INPUT ERROR: "+flag+" must be a non-negative integer. Please see --help for more information."
+            os._exit(1)
+    if int(stackDepth) < 1:
+        print "INPUT ERROR: -sd must be at least 1. Please see --help for more information."
+        os._exit(1)
+    if not is_number(frameReuseRatio) or not 0 <= float(frameReuseRatio) <= 1:
+        print "INPUT ERROR: -fr must be a number between 0 and 1. Please see --help for more information."
+        os._exit(1)
+
+    ################ START #################
+    rand = random.Random(int(seed))
+    with open(outfile, 'w') as dumpfile:
+        dumpfile.write('[BUILD]  Build information: (2018-01-15 08:47:44 019 Local)\nVersion: 2.00.024.00.1515582720\n[OK]\n--\n')
+        writeStackSection(dumpfile, int(nThreads), int(stackDepth), float(frameReuseRatio), int(nExceptThreads), int(minSize)*1024*1024, rand)
+        writeWaitGraphSection(dumpfile, int(nWaitEdges), rand)
+        writeStatisticsSection(dumpfile, int(nViews), int(nRowsPerView), rand)
+    print "File "+outfile+" was created ("+str(os.path.getsize(outfile)/1024/1024)+" MB)"
+
+
+if __name__ == '__main__':
+    main()
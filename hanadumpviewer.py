@@ -1,5 +1,24 @@
 # -*- coding: utf-8 -*-
-import sys, os, subprocess, tempfile
+import sys, os, subprocess, tempfile, multiprocessing, cStringIO, array, io, gzip, bz2, json, marshal, zlib, hashlib, time, fnmatch, socket, re, csv, heapq
+try:
+    import resource
+except ImportError:
+    resource = None   # e.g. on Windows, then the profile has no peak memory
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None   # .xz compressed dump files are then not supported
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None   # then -db is not supported
+try:
+    from scandir import scandir   # backport of os.scandir
+except ImportError:
+    scandir = None   # then the trace folder is read with os.listdir and os.stat
 
 def printHelp():
     print("                                                                                                                               ")    
@@ -19,22 +38,97 @@ def printHelp():
     print(" -rh     remove hex [true/false], true: remove string '+0x___' (where the _s could be any character until a space) from the    ")
     print("         stack function, note this will influence how a stack box is identified if -fl is large enough, default: true          ")
     print(" -ps     plot stack IDs [true/false], show the hexagonal ID in the boxes (cannot be true if -if is true), default: false       ")
+    print(" -zd     zip dot file(s) [true/false], true: the .dot file(s) are written gzip compressed as .dot.gz, default: false           ")
+    print(" -of     output formats, list of formats of the stack graph, seperated by only a comma, all are written in the same pass:      ")
+    print("         dot: .dot file for Graphviz, folded: .folded file with one 'frame;frame;frame count' line per stack, outermost        ")
+    print("         frame first, for flame graph tools, json: .json file with the nodes and edges of the graph, ndjson: .ndjson file with ")
+    print("         one node or edge per line, default: dot                                                                               ")
+    print(" -ag     aggregate [true/false], true: instead of one .dot file per dump file, all dump files are merged into one              ")
+    print("         <output directory>/aggregated_stack_graph.dot, where each box shows the total number of threads (#T) and the number   ")
+    print("         of dump files (#D) with this stack process, the threads per dump file are shown as tooltip, the dump files are        ")
+    print("         read one after the other (cannot be used together with -pt or -j), default: false                                     ")
+    print(" -ac     aggregate color [threads/dumps], threads: the color of a box shows its total number of threads, dumps: the color      ")
+    print("         of a box shows in how many dump files it exists, can only be used together with -ag, default: threads                 ")
+    print("         *** DIFF OPTIONS ***                                                                                                  ")
+    print(" -dd     diff dumps [true/false], true: the two dump files of -df (first the normal one, then the one to compare with it) are  ")
+    print("         compared in <output directory>/diff_stack_graph.dot, where each box and arrow shows the number of threads in both     ")
+    print("         dump files, red: more threads in the second dump file, blue: less threads, the boxes are matched by the same rules    ")
+    print("         as -if, -fl and -rh, and the stack processes and calls that gained or lost most threads are printed (cannot be used   ")
+    print("         together with -pt, -ag, -tk, -mt, -cc or -j), default: false                                                          ")
+    print(" -dm     diff movers [int], number of stack processes and of calls in the printed lists of -dd, default: 20                    ")
+    print("         *** PRUNING OPTIONS (for huge stack graphs) ***                                                                       ")
+    print(" -tk     top K paths [int], only the K stack paths (from the innermost to the outermost stack function) that are executed by   ")
+    print("         most threads are kept in the .dot file, 0: all paths are kept (cannot be used together with -pt), default: 0          ")
+    print(" -mt     min threads [int], stack boxes executed by less than this many threads are removed from the .dot file (thread boxes   ")
+    print("         are kept as long as a stack box points to them), default: 0                                                           ")
+    print(" -cc     collapse chains [true/false], true: a chain of stack boxes without branches, executed by exactly the same threads,    ")
+    print("         is shown as one single box with all its stack functions, default: false                                               ")
     print("         *** INDEXMANAGER WAIT DOT GRAPH ***                                                                                   ")
     print(" -mw     make wait dot graph [true/false], creates, an indexmanager_waitgraph_<dump file name>.dot file which is simply the    ")
-    print("         content of the [INDEXMANAGER_WAITGRAPH] section in the dump file, default: false                                      ")  
+    print("         content of the [INDEXMANAGER_WAITGRAPH] section in the dump file, default: false                                      ")
+    print(" -wa     wait analysis [true/false], true: the [INDEXMANAGER_WAITGRAPH] section is analyzed, a summary with the deadlock       ")
+    print("         cycles, the longest wait chain and the transactions that block most other transactions is printed, and an             ")
+    print("         indexmanager_waitanalysis_<dump file name>.dot file is created with only the cycles (red boxes) and the top           ")
+    print("         blockers (orange boxes, #W = number transactions waiting for it, directly or through other transactions),             ")
+    print("         default: false                                                                                                        ")
+    print(" -wt     wait top blockers [int], number of top blockers in the summary and the .dot file of -wa, default: 10                  ")
     print("         *** VIEW OPTIONS ***                                                                                                  ")
     print(" -mv     make views [true/false], creates, in the <output directory, see -od>/VIEWS_<dump file name>/ a <view name>.csv file   ")
     print("         for all views under the [STATISTICS] section in the dump file, default: false                                         ")     
+    print("         *** PERFORMANCE ***                                                                                                   ")
+    print(" -j      workers [int], number of dump files that are processed in parallel by a pool of worker processes, the output          ")
+    print("         of each dump file is still printed in the order of the dump files, default: 1 (no parallel processing)                ")
+    print(" -cs     frame cache size [int], maximum number of normalized stack frames (and cleaned up _ZN functions) that are cached,     ")
+    print("         so that a stack frame that appears in many threads is only normalized once, 0: no cache, default: 100000              ")
+    print(" -si     section index [true/false], true: the byte offsets of all sections of an uncompressed dump file are saved in a small  ")
+    print("         <dump file name>.idx file in the output directory (see -od), so that later runs on the same dump file (same size and  ")
+    print("         modification time) can directly read the needed sections instead of reading the whole dump file, default: true        ")
+    print(" -tc     thread cache [true/false], true: the threads parsed from the [STACK_SHORT] section are saved in a compact binary      ")
+    print("         file in <output directory>/hanadumpviewer_cache, so that later runs on the same dump file, e.g. with other -pt, -ps,  ")
+    print("         -if, -fl or -rh, do not have to read and parse the stack section again, a cached file is not used if the dump file    ")
+    print("         or hanadumpviewer.py was changed, default: false                                                                      ")
+    print(" -tm     thread cache max size [int], maximum size in MB of the thread cache, if it gets larger the least recently used        ")
+    print("         files are removed, default: 1024                                                                                      ")
+    print(" -pf     profile [true/false], true: for every dump file the wall time, bytes read, lines processed, threads and nodes created ")
+    print("         and the peak memory (RSS) of each stage (reading and parsing, building the graph, writing the output) are printed,    ")
+    print("         together with the hits and misses of the frame cache (see -cs), the peak memory of a stage can only be measured on    ")
+    print("         Linux, elsewhere the peak memory of the process so far is printed, default: false                                     ")
+    print(" -pj     profile json [true/false], true: the profile (see -pf) of all dump files is also written to                           ")
+    print("         <output directory>/hanadumpviewer_profile.json, can only be true if -pf is true, default: false                       ")
     print("         *** INPUT ***                                                                                                         ")
-    print(" -nd     number indexserver dumpfiles from cdtrace to create .dot files for (cannot be used together with -df), default: 0     ")
+    print(" -nd     number indexserver dumpfiles from cdtrace to create .dot files for, the latest modified first (cannot be used         ")
+    print("         together with -df), default: 0                                                                                        ")
     print(" -dt     dump type, the names of the dumpfiles used from cdtrace have to include this string, e.g. rte, crashdump, oom, etc.,  ")
-    print("         this flag can only be used together with -nd, default: '' (i.e. all indexserver trace files)                          ")
+    print("         this flag can only be used together with -nd or -wm, default: '' (i.e. all indexserver trace files)                   ")
     print(" -df     list of full path names of trace files with section STACK_SHORT, each trace file name, seperated by only a comma,     ")
     print("         will be used to create a .dot file, that can be viewed in  http://www.webgraphviz.com/  , default: '' (not used)      ")
+    print(" -es     early stop [true/false], true: stop reading a dump file as soon as all needed sections were read, this saves reading  ")
+    print("         (and decompressing) the rest of huge dump files, but if a section exists twice in a dump file only the first one is   ")
+    print("         used, default: false                                                                                                  ")
+    print("         Note: the dump files (-df and -nd) may be compressed with gzip (.gz), bzip2 (.bz2) or xz (.xz, needs the lzma module) ")
+    print("         and are then decompressed while they are read                                                                         ")
+    print("         *** WATCH MODE ***                                                                                                    ")
+    print(" -wm     watch mode [true/false], true: the cdtrace folder is polled for new indexserver dump files (only those with -dt in    ")
+    print("         their names if -dt is given, otherwise all with dump in their names, so not the indexserver trace logs), a new dump   ")
+    print("         file is processed as soon as its size did not change for -ws polls, the processed dump files are listed in <output    ")
+    print("         directory>/hanadumpviewer_watch_manifest.json so that they are not processed again, also not after a restart, the     ")
+    print("         dump files that already exist when the watch mode is started the first time (without a manifest) are only listed      ")
+    print("         there, stop it with Ctrl-C (cannot be used together with -df, -nd, -ag or -pj), default: false                        ")
+    print(" -wi     watch interval [int], seconds between two polls of the cdtrace folder, default: 10                                    ")
+    print(" -ws     watch stable polls [int], number of polls a new trace file must keep the same size and modification time before       ")
+    print("         it is processed, so that trace files that are still being written are not processed, default: 1                       ")
     print("         *** OUTPUT ***                                                                                                        ")
     print(" -od     output directory, full path of the folder where all output files will end up (if not exist it will be created),       ")
     print("         default: '/<tempdir>/hanadumpviewer_output' where <tempdir> is automatically selected based on OS, for Windows        ")
     print("         it could be e.g. C:\TEMP, and for Linux it could be e.g. /tmp                                                         ")
+    print(" -db     database, full path of a SQLite database file (created if it does not exist) that every dump file is loaded into,     ")
+    print("         in one transaction per dump file: the tables dumps, threads (with -md true or false), frames (one row per stack       ")
+    print("         line of a thread, the stack function as in the .dot files, see -fl and -rh, but with < and > instead of &lt; and      ")
+    print("         &gt;), views (the list of the views of the [STATISTICS] section) and one view_<view name> table per view with a       ")
+    print("         dump_id column and the columns of the view, a dump file that is loaded again replaces its earlier rows, e.g. to       ")
+    print("         compare the threads of 50 dump files:                                                                                 ")
+    print("         select d.dump_file, t.thread_type, count(*) from threads t join dumps d on d.dump_id = t.dump_id group by 1, 2,       ")
+    print("         default: '' (not used)                                                                                                ")
     print("                                                                                                                               ")    
     print("                                                                                                                               ")
     print("EXAMPLE (create .dot files for the 5 latest created indexserver trace files in cdtrace, and show the threads):                 ")
@@ -58,37 +152,110 @@ def printHelp():
     os._exit(1)
 
 ######################## DEFINE CLASSES ##################################
-class StackThread:
-    def __init__(self, threadId, threadType):
+class DumpFileError(Exception):   # something is wrong with one dump file, the other dump files can still be processed
+    pass
+
+class FrameTable(object):
+    # every distinct stack frame (stack line without frame number) is only stored once, threads refer to it by its integer frame ID
+    def __init__(self):
+        self.frameIds = {}
+        self.frames = []
+    def set_frames(self, frames):
+        self.frames = frames
+        self.frameIds = dict((frames[frameId], frameId) for frameId in range(len(frames)))
+    def add_frame(self, frame):
+        frameId = self.frameIds.get(frame)
+        if frameId is None:
+            frameId = len(self.frames)
+            self.frames.append(frame)
+            self.frameIds[frame] = frameId
+        return frameId
+
+class StackThread(object):
+    __slots__ = ['id', 'type', 'isException', 'frameIds', 'frameTable']
+    def __init__(self, threadId, threadType, frameTable):
         self.id = threadId
         self.type = threadType
-        self.lines = []
         self.isException = False
+        self.frameIds = array.array('i')
+        self.frameTable = frameTable
     def add_line(self, line):
-        self.lines.append(line)
+        self.frameIds.append(self.frameTable.add_frame(stackFrame(line)))
+    def frames(self):
+        return [self.frameTable.frames[frameId] for frameId in self.frameIds]
     def printThread(self):
         if self.isException:
             print "Exception ID: ", self.id, "  Exception Reason: ", self.type, "  Stack Lines:\n"
         else:
             print "Thread ID: ", self.id, "  Thread Type: ", self.type, "  Stack Lines:\n"
-        print self.lines
+        print self.frames()
         
+
+class ThreadParser:
+    # parses the [STACK_SHORT] section line by line and hands every thread to threadConsumer as soon as it is complete,
+    # so that the threads do not have to be kept in memory 
+    def __init__(self, threadConsumer):
+        self.threadConsumer = threadConsumer
+        self.thread = None   # the thread that is currently parsed
+        self.frameTable = FrameTable()   # shared by all threads of this section
+        self.nLines = 0
+        self.nThreads = 0
+        self.nNormalThreads = 0
+        self.nExceptThreads = 0
+    def add_line(self, line):
+        self.nLines += 1
+        threadStart = '[thr=' in line and not 'inactive' in line
+        exceptStart = 'Allocation failed' in line
+        threadStop = line == '--\n' or ('exception' in line and 'no.' in line)
+        exceptStop = line == '\n' or line == '--\n'
+        exceptFirst = 'exception throw location' in line
+        if self.thread is None and (threadStart or exceptStart):
+            if threadStart:
+                threadId = line.split('[thr=')[1].split(']: ')[0]
+                threadType = line.split(']: ')[1].split(' at')[0]
+                self.nNormalThreads += 1
+            else: 
+                threadId = str(self.nExceptThreads)
+                threadType = line.strip(' ').replace('$','').replace('\n','') #aka reason
+                self.nExceptThreads += 1
+            self.thread = StackThread(threadId, threadType, self.frameTable)
+            if exceptStart:
+                self.thread.isException = True
+        elif self.thread is not None and (threadStop or exceptStop):
+            self.end_thread()
+        elif self.thread is not None and not exceptFirst:
+            if not ' in ' in line:
+                raise DumpFileError("Something went wrong, in thread the line should here be a normal stack line, i.e. include ' in ', line = \n"+line)
+            self.thread.add_line(line)
+    def end_thread(self):
+        thread = self.thread
+        self.thread = None
+        self.nThreads += 1
+        self.threadConsumer(thread)
+    def finish(self):
+        if self.thread is not None:
+            self.end_thread()
+        if not self.nThreads:
+            raise DumpFileError("No threads were created")
         
-class DotLine:
+class DotLine(object):
+    __slots__ = ['dotNumber', 'stackThreadId', 'function', 'parentDotNumbers', 'parentDotNumberSet', 'usedByThreads', 'isThread', 'isException', 'idByFunction', 'dumpThreadCounts']
+    red_scale = ['#ffffff', '#ffebeb', '#ffd8d8', '#ffc4c4', '#ffb1b1', '#ff9d9d', '#ff8989', '#ff7676', '#ff6262', '#ff4e4e', '#ff3b3b', '#ff2727', '#ff1414', '#ff0000']
+    blue_scale = ['#ffffff', '#ebebff', '#d8d8ff', '#c4c4ff', '#b1b1ff', '#9d9dff', '#8989ff', '#7676ff', '#6262ff', '#4e4eff', '#3b3bff', '#2727ff', '#1414ff', '#0000ff']
+    maxParentsWithoutSet = 8   # most dot lines have only a few parents, a set for fast lookups is only created for dot lines with many parents 
     def __init__(self, dotNumber, stackThreadId, function, idByFunction = False):
         self.dotNumber = dotNumber
-        self.stackThreadId = stackThreadId  # if stack: hexagonal stack id, if thread: thread id
+        self.stackThreadId = intern(stackThreadId)  # if stack: hexagonal stack id, if thread: thread id
         if '_ZN' in function:   #fix uggly _ZN lines 
-            function = function.split('ER')[0].strip('_ZNK').strip('_ZN')
-            function = "".join(["::" if char.isdigit() else char for char in function])
-            function = function.replace('::::','::').strip('::')
-        self.function = function
+            function = cleanZNFunction(function)
+        self.function = intern(function)
         self.parentDotNumbers = []  
-        self.usedByThreads = []
+        self.parentDotNumberSet = None   # same as parentDotNumbers, for fast lookups
+        self.usedByThreads = set()
         self.isThread = False
         self.isException = False
         self.idByFunction = idByFunction
-        self.red_scale = ['#ffffff', '#ffebeb', '#ffd8d8', '#ffc4c4', '#ffb1b1', '#ff9d9d', '#ff8989', '#ff7676', '#ff6262', '#ff4e4e', '#ff3b3b', '#ff2727', '#ff1414', '#ff0000']
+        self.dumpThreadCounts = None   # only for aggregated graphs: dump index --> number threads in that dump
     def getID(self):
         if self.isThread:
             return self.stackThreadId
@@ -97,20 +264,36 @@ class DotLine:
         return self.stackThreadId
     def add_parent(self, parentDotNumber):
         self.parentDotNumbers.append(parentDotNumber)
+        if self.parentDotNumberSet is not None:
+            self.parentDotNumberSet.add(parentDotNumber)
+        elif len(self.parentDotNumbers) > self.maxParentsWithoutSet:
+            self.parentDotNumberSet = set(self.parentDotNumbers)
     def add_parent_if_not_listed(self, parentDotNumber):
-        if not parentDotNumber in self.parentDotNumbers:
+        parentDotNumbers = self.parentDotNumbers if self.parentDotNumberSet is None else self.parentDotNumberSet
+        if not parentDotNumber in parentDotNumbers:
             self.add_parent(parentDotNumber)
     def add_thread(self, usedByThread):
-        self.usedByThreads.append(usedByThread)
+        self.usedByThreads.add(usedByThread)
     def add_thread_if_not_listed(self, usedByThread):
-        if not usedByThread in self.usedByThreads:
-            self.add_thread(usedByThread)
-    def color(self, maxNbrThreads = 1):
+        self.usedByThreads.add(usedByThread)
+    def color(self, maxNbrThreads = 1, nbrThreads = None):
         if self.isThread:
             return '#00ffff'  #cyan
         if self.isException:
             return '#ffa500'  #orange
-        return self.red_scale[ int(float(len(self.usedByThreads)) / float(maxNbrThreads) * (len(self.red_scale)-1)) ]  
+        if nbrThreads is None:
+            nbrThreads = len(self.usedByThreads)
+        return self.red_scale[ int(float(nbrThreads) / float(maxNbrThreads) * (len(self.red_scale)-1)) ]  
+    def nbrThreads(self):
+        return self.totalThreads() if self.dumpThreadCounts is not None else len(self.usedByThreads)
+    def hasSameThreads(self, dotLine):
+        if self.dumpThreadCounts is not None:
+            return self.dumpThreadCounts == dotLine.dumpThreadCounts
+        return self.usedByThreads == dotLine.usedByThreads
+    def totalThreads(self):
+        return sum(self.dumpThreadCounts.values()) if self.dumpThreadCounts else 0
+    def nbrDumps(self):
+        return len(self.dumpThreadCounts) if self.dumpThreadCounts else 0
     def setIsThread(self, isThread):
         self.isThread = isThread
         self.testThreadType()
@@ -119,8 +302,7 @@ class DotLine:
         self.testThreadType()
     def testThreadType(self):
         if self.isThread and self.isException:
-            print "ERROR: Something Went Wrong: A DotLine can only be either a normal thread or a exception thread."
-            os._exit(1)
+            raise DumpFileError("Something Went Wrong: A DotLine can only be either a normal thread or a exception thread.")
     def printDotLine(self):
         if self.isThread:            
             print "Dot Line Number: ", self.dotNumber, "  Thread ID: ", self.stackThreadId, "  Thread Type: ", self.function, "  Parent Dot Numbers:", self.parentDotNumbers
@@ -129,8 +311,473 @@ class DotLine:
         else:
             print "Dot Line Number: ", self.dotNumber, "  Stack ID: ", self.stackThreadId, "  Code Function: ", self.function, "  Parent Dot Numbers:", self.parentDotNumbers
         
+class FrameCache:
+    # bounded memory of already normalized stack frames, when it is full it is emptied and filled again 
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+    def lookup(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+    def store(self, key, value):
+        if self.maxSize <= 0:
+            return
+        if len(self.entries) >= self.maxSize:
+            self.entries.clear()
+        self.entries[key] = value
+    def resize(self, maxSize):
+        self.maxSize = maxSize
+        if len(self.entries) > maxSize:
+            self.entries.clear()
+    def stats(self):
+        return [self.hits, self.misses]
+
+class DumpProfile:
+    # wall time, bytes read, lines processed, threads and nodes created and peak memory of each stage of one dump file, the 
+    # peak memory is the one of the stage if the peak can be reset (Linux), otherwise the one of the process so far 
+    def __init__(self, dumpfile):
+        self.dumpfile = dumpfile
+        self.stages = []
+        self.peakPerStage = resetPeakRSS()
+        self.peakKey = 'peak_rss_mb' if self.peakPerStage else 'process_peak_rss_mb'
+        self.stageStart = time.time()
+        self.frameCache = {'hits':0, 'misses':0}   # of the frame cache while this dump file was processed, see -cs
+    def start_stage(self):
+        if self.peakPerStage:
+            resetPeakRSS()
+        self.stageStart = time.time()
+    def end_stage(self, stage, bytesRead = 0, lines = 0, threads = 0, nodes = 0, seconds = None, withPreviousStage = False):
+        # withPreviousStage: the stage ran interleaved with the previous stage, so it has the same peak memory
+        if seconds is None:
+            seconds = time.time() - self.stageStart
+        peak = self.stages[-1][self.peakKey] if withPreviousStage and self.stages else peakRSSMB()
+        self.stages.append({'stage':stage, 'seconds':seconds, 'bytes_read':bytesRead, 'lines':lines, 'threads':threads, 'nodes':nodes, self.peakKey:peak})
+        self.start_stage()
+    def printProfile(self):
+        print "Profile of "+self.dumpfile+":"
+        print "  %-16s %10s %14s %12s %10s %10s %16s" % ('STAGE', 'SECONDS', 'BYTES READ', 'LINES', 'THREADS', 'NODES', 'PEAK RSS MB' if self.peakPerStage else 'PROCESS PEAK MB')
+        for stage in self.stages:
+            print "  %-16s %10.3f %14d %12d %10d %10d %16.1f" % (stage['stage'], stage['seconds'], stage['bytes_read'], stage['lines'], stage['threads'], stage['nodes'], stage[self.peakKey])
+        print "  %-16s %10.3f" % ('total', sum([stage['seconds'] for stage in self.stages]))
+        [hits, misses] = [self.frameCache['hits'], self.frameCache['misses']]
+        if hits + misses:
+            print "  Frame cache: "+str(hits)+" hits, "+str(misses)+" misses, hit rate "+str(round(100.0*hits/(hits + misses), 1))+" %"
+    def set_frame_cache_stats(self, hits, misses):
+        self.frameCache = {'hits':hits, 'misses':misses}
+    def report(self):
+        return {'dumpfile':self.dumpfile, 'stages':self.stages, 'frame_cache':self.frameCache}
+
+class DotGraph:
+    def __init__(self, plot_threads, functionLength, removeHexFromFunction, id_by_function, aggregated = False, recordPaths = False, recordEdges = False):
+        self.plot_threads = plot_threads
+        self.functionLength = functionLength
+        self.removeHexFromFunction = removeHexFromFunction
+        self.id_by_function = id_by_function
+        self.dotLines = []   # the dot number of a dot line is also its index in dotLines
+        self.dotLineIndex = {}   # ID of a non-thread dot line --> its dot number 
+        self.maxNbrThreads = 0
+        self.aggregated = aggregated   # true: threads of many dump files are merged, see end_dump
+        self.dumpNames = []
+        self.touchedDotLines = []   # dot lines used by threads of the current dump file
+        self.recordPaths = recordPaths
+        self.pathCounts = {}   # path of stack dot numbers of a thread --> [number threads with this path, order of first appearance]
+        self.recordEdges = recordEdges
+        self.edgeThreadCounts = {}   # (dot number, parent dot number) --> {dump index: number threads with this call}
+        self.dumpStartDotNumber = 0   # dot lines from this dot number on were created by the current dump file
+        self.addedParents = []   # [dot line, parent dot number] added to older dot lines by the current dump file, see discard_dump
+        self.addedPaths = []   # paths counted for the current dump file, see discard_dump
+    def findDotLineNumber(self, searchId):
+        return self.dotLineIndex.get(searchId, -1)
+    def add_dot_line(self, dotLine):
+        self.dotLines.append(dotLine)
+        if not dotLine.isThread and not dotLine.getID() in self.dotLineIndex:
+            self.dotLineIndex[dotLine.getID()] = dotLine.dotNumber
+    def add_thread(self, thread):
+        dotLineNumberOfPrevStackLine = -1
+        if self.plot_threads:
+            dotLine = DotLine(len(self.dotLines), thread.id, thread.type)
+            dotLine.add_parent(dotLineNumberOfPrevStackLine)   
+            dotLine.add_thread(thread.id)
+            dotLine.setIsThread(not thread.isException)
+            dotLine.setIsException(thread.isException)
+            self.add_dot_line(dotLine)
+            dotLineNumberOfPrevStackLine = dotLine.dotNumber
+        path = []
+        threadEdges = set()   # a thread is only counted once per edge, also if it has recursive calls
+        for frame in thread.frames():
+            [stackLineId, stackLineFunction] = splitStackFrame(frame, self.functionLength, self.removeHexFromFunction)
+            searchId = stackLineFunction if self.id_by_function else stackLineId
+            if self.aggregated and self.id_by_function and '_ZN' in searchId:   # as getID, so that the dump files share these dot lines 
+                searchId = cleanZNFunction(searchId)
+            dotLineNumberWithThisDotId = self.findDotLineNumber(searchId)
+            if dotLineNumberWithThisDotId < 0:  #then there is no dotline from this stackline yet
+                dotLine = DotLine(len(self.dotLines), stackLineId, stackLineFunction, self.id_by_function)
+                dotLine.add_parent(dotLineNumberOfPrevStackLine)
+                self.add_dot_line(dotLine)
+            else:
+                dotLine = self.dotLines[dotLineNumberWithThisDotId]
+                nParents = len(dotLine.parentDotNumbers)
+                dotLine.add_parent_if_not_listed(dotLineNumberOfPrevStackLine)
+                if self.aggregated and len(dotLine.parentDotNumbers) > nParents and dotLine.dotNumber < self.dumpStartDotNumber:
+                    self.addedParents.append([dotLine, dotLineNumberOfPrevStackLine])
+            if self.aggregated and not dotLine.usedByThreads:
+                self.touchedDotLines.append(dotLine)
+            if self.recordEdges and dotLineNumberOfPrevStackLine >= 0 and not (dotLine.dotNumber, dotLineNumberOfPrevStackLine) in threadEdges:
+                edge = (dotLine.dotNumber, dotLineNumberOfPrevStackLine)
+                threadEdges.add(edge)
+                dumpThreadCounts = self.edgeThreadCounts.setdefault(edge, {})
+                dumpThreadCounts[len(self.dumpNames)] = dumpThreadCounts.get(len(self.dumpNames), 0) + 1
+            dotLine.add_thread_if_not_listed(thread.id)
+            self.maxNbrThreads = max(len(dotLine.usedByThreads), self.maxNbrThreads)
+            dotLineNumberOfPrevStackLine = dotLine.dotNumber
+            if self.recordPaths:
+                path.append(dotLine.dotNumber)
+        if self.recordPaths and path:
+            pathCount = self.pathCounts.get(tuple(path))
+            if pathCount is None:
+                self.pathCounts[tuple(path)] = [1, len(self.pathCounts)]
+            else:
+                pathCount[0] += 1
+            if self.aggregated:
+                self.addedPaths.append(tuple(path))
+    def end_dump(self, dumpName):
+        # the threads of a dump file are only counted per dump file, so that thread IDs of different dump files cannot be mixed up, 
+        # and the memory only grows with the number of stack processes 
+        dumpIndex = len(self.dumpNames)
+        self.dumpNames.append(dumpName)
+        for dotLine in self.touchedDotLines:
+            if dotLine.dumpThreadCounts is None:
+                dotLine.dumpThreadCounts = {}
+            dotLine.dumpThreadCounts[dumpIndex] = len(dotLine.usedByThreads)
+            dotLine.usedByThreads = set()
+        self.touchedDotLines = []
+        self.maxNbrThreads = 0
+        self.dumpStartDotNumber = len(self.dotLines)
+        self.addedParents = []
+        self.addedPaths = []
+    def discard_dump(self):
+        # a dump file that could not be processed is not counted, everything it added to the graph is removed again
+        for dotLine in self.touchedDotLines:
+            dotLine.usedByThreads = set()
+        for [edge, dumpThreadCounts] in self.edgeThreadCounts.items():
+            dumpThreadCounts.pop(len(self.dumpNames), None)
+            if not dumpThreadCounts:
+                del self.edgeThreadCounts[edge]
+        for [dotLine, parentDotNumber] in reversed(self.addedParents):
+            dotLine.parentDotNumbers.pop()   # the added parents are the last ones of the dot line
+            if dotLine.parentDotNumberSet is not None:
+                dotLine.parentDotNumberSet.discard(parentDotNumber)
+        for path in self.addedPaths:
+            pathCount = self.pathCounts[path]
+            pathCount[0] -= 1
+            if not pathCount[0]:
+                del self.pathCounts[path]
+        for dotLine in self.dotLines[self.dumpStartDotNumber:]:
+            if self.dotLineIndex.get(dotLine.getID()) == dotLine.dotNumber:
+                del self.dotLineIndex[dotLine.getID()]
+        del self.dotLines[self.dumpStartDotNumber:]
+        self.touchedDotLines = []
+        self.maxNbrThreads = 0
+        self.addedParents = []
+        self.addedPaths = []
+    def checkDotLines(self):
+        if not self.dotLines:
+            raise DumpFileError("No dot lines were created")
+        if not self.maxNbrThreads:
+            raise DumpFileError("maxNbrThreads = "+str(self.maxNbrThreads))
+        
+class WaitGraph:
+    # the edges "waiter" -> "holder" of the [INDEXMANAGER_WAITGRAPH] section, every step of the analysis is linear 
+    # in the number of transactions and waits, so that it also works for huge lock storms
+    def __init__(self):
+        self.nodeNames = []   # the node number of a transaction is its index in nodeNames
+        self.nodeIndex = {}   # transaction (as written in the dump file, with quotes) --> node number
+        self.successors = []   # node number --> node numbers of the transactions it waits for
+        self.nWaiters = []   # node number --> number transactions directly waiting for it
+        self.edgeAttributes = {}   # [waiter, holder] --> attributes of the edge, e.g. [label="exclusive lock"]
+        self.componentOf = []   # node number --> number of its strongly connected component, see analyze
+    def node(self, name):
+        number = self.nodeIndex.get(name)
+        if number is None:
+            number = len(self.nodeNames)
+            self.nodeIndex[name] = number
+            self.nodeNames.append(name)
+            self.successors.append([])
+            self.nWaiters.append(0)
+        return number
+    def add_line(self, line):
+        # an edge line is e.g.   "Transaction 1" -> "Transaction 2" [label="exclusive lock"];
+        if not '->' in line:
+            return
+        [waiterText, holderText] = line.split('->', 1)
+        waiterText = waiterText.strip()
+        holderText = holderText.strip().rstrip(';').rstrip()
+        if holderText.startswith('"'):   # quoted transaction, may include spaces and escaped quotes
+            end = holderText.find('"', 1)
+            while end > 0 and holderText[end-1] == '\\':
+                end = holderText.find('"', end+1)
+            if end < 0:
+                return
+            [holderText, attributes] = [holderText[:end+1], holderText[end+1:].strip()]
+        else:
+            [holderText, attributes] = (holderText.split(None, 1) + [''])[:2]
+        if not waiterText or not holderText:
+            return
+        [waiter, holder] = [self.node(waiterText), self.node(holderText)]
+        if not (waiter, holder) in self.edgeAttributes:
+            self.successors[waiter].append(holder)
+            self.nWaiters[holder] += 1
+            self.edgeAttributes[(waiter, holder)] = attributes
+    def nbrWaits(self):
+        return len(self.edgeAttributes)
+    def strongly_connected_components(self):
+        # iterative Tarjan, returns [component number of each node, components], the components come in reverse topological 
+        # order, i.e. a component comes after all components it waits for
+        nNodes = len(self.nodeNames)
+        index = [-1]*nNodes
+        lowLink = [0]*nNodes
+        onStack = [False]*nNodes
+        componentOf = [-1]*nNodes
+        components = []
+        stack = []
+        nextIndex = 0
+        for root in range(nNodes):
+            if index[root] >= 0:
+                continue
+            work = [[root, 0]]   # [node, position of the next successor to visit]
+            index[root] = lowLink[root] = nextIndex
+            nextIndex += 1
+            stack.append(root)
+            onStack[root] = True
+            while work:
+                frame = work[-1]
+                node = frame[0]
+                successors = self.successors[node]
+                if frame[1] < len(successors):
+                    successor = successors[frame[1]]
+                    frame[1] += 1
+                    if index[successor] < 0:
+                        index[successor] = lowLink[successor] = nextIndex
+                        nextIndex += 1
+                        stack.append(successor)
+                        onStack[successor] = True
+                        work.append([successor, 0])
+                    elif onStack[successor]:
+                        lowLink[node] = min(lowLink[node], index[successor])
+                    continue
+                work.pop()
+                if work:
+                    lowLink[work[-1][0]] = min(lowLink[work[-1][0]], lowLink[node])
+                if lowLink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        onStack[member] = False
+                        componentOf[member] = len(components)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+        return [componentOf, components]
+    recountWork = 10   # the exact counts of the top blockers may visit at most this many times the transactions and waits
+    def count_waiters(self, node, predecessors, budget):
+        # exact number of transactions that wait for node, directly or through other transactions, by a backwards search,
+        # every visited wait is taken from budget ([remaining waits]), None if the budget runs out
+        visited = set([node])
+        todo = [node]
+        while todo:
+            waiters = predecessors[todo.pop()]
+            budget[0] -= len(waiters)
+            if budget[0] < 0:
+                return None
+            for waiter in waiters:
+                if not waiter in visited:
+                    visited.add(waiter)
+                    todo.append(waiter)
+        return len(visited) - 1
+    def top_blockers(self, nTopBlockers, waiterBounds):
+        # the waiters summed over the condensation are an upper bound (exact if every transaction waits for at most one 
+        # other), the candidates are counted exactly in the order of their bounds until no other candidate can get 
+        # into the top list, but all exact counts together are limited to recountWork times the size of the graph, 
+        # after that the upper bounds are used, returns [blockers, waiters of them, blockers with only an upper bound]
+        predecessors = [[] for node in self.nodeNames]
+        for [waiter, holder] in self.edgeAttributes:
+            predecessors[holder].append(waiter)
+        candidates = sorted([node for node in range(len(self.nodeNames)) if self.nWaiters[node]], key = lambda node: (-waiterBounds[node], -self.nWaiters[node], node))
+        budget = [self.recountWork*(len(self.nodeNames) + self.nbrWaits())]
+        waiters = {}
+        upperBounds = set()
+        topWaiters = []   # min heap of the nTopBlockers largest waiters so far
+        componentWaiters = {}   # the transactions of a cycle all have the same waiters (plus the other transactions of the cycle)
+        for node in candidates:
+            if len(topWaiters) >= nTopBlockers and (not nTopBlockers or topWaiters[0] >= waiterBounds[node]):
+                break
+            if not self.componentOf[node] in componentWaiters and budget[0] >= 0:
+                componentWaiters[self.componentOf[node]] = self.count_waiters(node, predecessors, budget)
+            waiters[node] = componentWaiters.get(self.componentOf[node])
+            if waiters[node] is None:   # the budget ran out
+                waiters[node] = waiterBounds[node]
+                upperBounds.add(node)
+            if len(topWaiters) < nTopBlockers:
+                heapq.heappush(topWaiters, waiters[node])
+            elif waiters[node] > topWaiters[0]:
+                heapq.heapreplace(topWaiters, waiters[node])
+        blockers = sorted(waiters, key = lambda node: (-waiters[node], -self.nWaiters[node], node))[:nTopBlockers]
+        return [blockers, waiters, upperBounds]
+    def analyze(self):
+        # returns [cycles, upper bound of the transitive waiters of each node, wait chain depth of each node], the depth of 
+        # a transaction is the length of the longest wait chain that ends at it (a cycle counts as one link)
+        [componentOf, components] = self.strongly_connected_components()
+        self.componentOf = componentOf
+        cycles = [component for component in components if len(component) > 1 or (component[0], component[0]) in self.edgeAttributes]
+        componentWaiters = [0]*len(components)
+        componentDepth = [0]*len(components)
+        for c in reversed(range(len(components))):   # topological order, the waiters before the transactions they wait for 
+            holderComponents = set([componentOf[successor] for node in components[c] for successor in self.successors[node]])
+            holderComponents.discard(c)
+            for holderComponent in holderComponents:
+                componentWaiters[holderComponent] += componentWaiters[c] + len(components[c])
+                componentDepth[holderComponent] = max(componentDepth[holderComponent], componentDepth[c] + 1)
+        waiters = [min(componentWaiters[componentOf[node]] + len(components[componentOf[node]]) - 1, len(self.nodeNames) - 1) for node in range(len(self.nodeNames))]
+        depths = [componentDepth[componentOf[node]] for node in range(len(self.nodeNames))]
+        return [cycles, waiters, depths]
+
+class DumpDatabase:
+    # SQLite store of the threads, stack frames and views of the dump files, each dump file is loaded in one transaction 
+    # with batched inserts, so that later analyses are SQL queries instead of parsing the dump files again, while the dump 
+    # file is read the threads and frames are only written to temporary tables of this connection, which do not lock the 
+    # database file
+    batchSize = 10000
+    schema = ["create table if not exists dumps (dump_id integer primary key, dump_file text unique, size integer, mtime real, loaded text)",
+              "create table if not exists threads (dump_id integer, thread_number integer, thread_id text, thread_type text, thread_info text, is_exception integer, nbr_frames integer)",
+              "create index if not exists threads_dump_type on threads (dump_id, thread_type)",
+              "create table if not exists frames (dump_id integer, thread_number integer, frame_number integer, stack_id text, function text)",
+              "create index if not exists frames_dump_thread on frames (dump_id, thread_number)",
+              "create table if not exists views (dump_id integer, view_name text, table_name text, nbr_rows integer)",
+              "create index if not exists views_dump_view on views (dump_id, view_name)"]
+    tempSchema = ["create temp table if not exists dump_threads (thread_number integer, thread_id text, thread_type text, thread_info text, is_exception integer, nbr_frames integer)",
+                  "create temp table if not exists dump_frames (thread_number integer, frame_number integer, stack_id text, function text)"]
+    def __init__(self, dbfile, functionLength, removeHexFromFunction):
+        # the transactions are started and committed explicitly, so that also new view tables are part of the transaction of 
+        # the dump file, parallel workers (see -j) only wait for each other while a dump file is copied from the temporary 
+        # tables, see end_dump
+        self.connection = sqlite3.connect(dbfile, timeout = 600, isolation_level = None)
+        for statement in self.schema + self.tempSchema:
+            self.connection.execute(statement)
+        self.functionLength = functionLength
+        self.removeHexFromFunction = removeHexFromFunction
+        self.dumpfile = None
+        self.dumpId = None
+        self.inTransaction = False
+        self.nThreads = 0
+        self.threadRows = []
+        self.frameRows = []
+    def begin_dump(self, dumpfile):
+        self.dumpfile = os.path.abspath(dumpfile)
+        self.clear_temp_tables()
+        self.nThreads = 0
+    def clear_temp_tables(self):
+        self.connection.execute("delete from temp.dump_threads")
+        self.connection.execute("delete from temp.dump_frames")
+    def add_thread(self, thread):
+        self.nThreads += 1
+        frames = thread.frames()
+        threadType = re.split('[,;]', thread.type)[0].strip()   # e.g. JobWorker from 'JobWorker, TID: 12, ...' or Allocation failed from 'Allocation failed ; ...'
+        self.threadRows.append((self.nThreads, sqlText(thread.id), sqlText(threadType), sqlText(thread.type), int(thread.isException), len(frames)))
+        for [frameNumber, frame] in enumerate(frames):
+            [stackId, function] = splitStackFrame(frame, self.functionLength, self.removeHexFromFunction)
+            if '_ZN' in function:   # as in the dot files
+                function = cleanZNFunction(function)
+            self.frameRows.append((self.nThreads, frameNumber + 1, stackId, sqlText(plainFunction(function))))
+        if len(self.frameRows) >= self.batchSize:
+            self.flush()
+    def flush(self):
+        self.connection.executemany("insert into temp.dump_threads values (?, ?, ?, ?, ?, ?)", self.threadRows)
+        self.connection.executemany("insert into temp.dump_frames values (?, ?, ?, ?)", self.frameRows)
+        self.threadRows = []
+        self.frameRows = []
+    def add_views(self, statLines):
+        # the views are found as in makeViews, the first line of a view is its header
+        view = None
+        viewLines = []
+        for line in statLines:
+            if view is None:
+                words = line.split(' ')
+                if len(words) > 1 and words[1] == '-':   # View starts
+                    view = words[0]
+                    viewLines = []
+            elif line.startswith("("+view+","):   # View ends
+                self.add_view(view, viewLines)
+                view = None
+            else:
+                viewLines.append(line)
+        if view is not None:
+            self.add_view(view, viewLines)
+    def add_view(self, view, viewLines):
+        rows = list(csv.reader(viewLines))
+        if not rows or not rows[0]:
+            return
+        tableName = 'view_'+re.sub(r'\W', '_', view)
+        columns = []
+        for [i, column] in enumerate(rows[0]):
+            column = re.sub(r'\W', '_', column.strip()) or 'column_'+str(i+1)
+            while column.upper() in [c.upper() for c in columns] or column.upper() == 'DUMP_ID':   # SQLite column names are case insensitive
+                column += '_'
+            columns.append(column)
+        existingColumns = [row[1].upper() for row in self.connection.execute('pragma table_info("'+tableName+'")').fetchall()]
+        if not existingColumns:
+            self.connection.execute('create table "'+tableName+'" (dump_id integer, '+', '.join(['"'+column+'"' for column in columns])+')')
+            self.connection.execute('create index "'+tableName+'_dump" on "'+tableName+'" (dump_id)')
+        for column in columns:
+            if existingColumns and not column.upper() in existingColumns:   # e.g. a newer HANA revision has more columns
+                self.connection.execute('alter table "'+tableName+'" add column "'+column+'"')
+        nColumns = len(columns)
+        self.connection.executemany('insert into "'+tableName+'" (dump_id, '+', '.join(['"'+column+'"' for column in columns])+') values ('+', '.join(['?']*(nColumns+1))+')',
+                                    ([self.dumpId] + [sqlValue(value) for value in (row + ['']*nColumns)[:nColumns]] for row in rows[1:] if row))
+        self.connection.execute("insert into views values (?, ?, ?, ?)", [self.dumpId, sqlText(view), tableName, len([row for row in rows[1:] if row])])
+    def end_dump(self, statLines):
+        # the database is only locked now, when the dump file is already parsed
+        self.flush()
+        stat = os.stat(self.dumpfile)
+        self.connection.execute("begin immediate")
+        self.inTransaction = True
+        for [dumpId] in self.connection.execute("select dump_id from dumps where dump_file = ?", [sqlText(self.dumpfile)]).fetchall():   # loaded again
+            for [tableName] in self.connection.execute("select distinct table_name from views where dump_id = ?", [dumpId]).fetchall():
+                self.connection.execute('delete from "'+tableName+'" where dump_id = ?', [dumpId])
+            for tableName in ['threads', 'frames', 'views', 'dumps']:
+                self.connection.execute("delete from "+tableName+" where dump_id = ?", [dumpId])
+        self.dumpId = self.connection.execute("insert into dumps (dump_file, size, mtime, loaded) values (?, ?, ?, ?)", 
+                                              [sqlText(self.dumpfile), stat.st_size, stat.st_mtime, time.strftime('%Y-%m-%d %H:%M:%S')]).lastrowid
+        self.connection.execute("insert into threads select ?, * from temp.dump_threads", [self.dumpId])
+        self.connection.execute("insert into frames select ?, * from temp.dump_frames", [self.dumpId])
+        self.add_views(statLines)
+        self.connection.execute("commit")
+        self.inTransaction = False
+        self.dumpId = None
+        self.clear_temp_tables()
+    def abort_dump(self):
+        self.threadRows = []
+        self.frameRows = []
+        if self.inTransaction:
+            self.connection.execute("rollback")
+            self.inTransaction = False
+        self.dumpId = None
+        self.clear_temp_tables()
+    def close(self):
+        self.connection.close()
+
 ######################## DEFINE FUNCTIONS ################################
 
+frameCache = FrameCache(100000)   # (stack frame, -fl, -rh) --> [stack id, stack function]
+znFunctionCache = FrameCache(100000)   # _ZN function --> cleaned up function
+cdtraceCache = {}   # 'path' --> the trace folder, see cdtrace
+
 def is_integer(s):
     try:
         int(s)
@@ -145,12 +792,18 @@ def is_number(s):
     except ValueError:
         return False
     
-def findDotLineNumber(searchId, dotLines):
-    for dotLine in dotLines:
-        if not dotLine.isThread:
-            if searchId == dotLine.getID():
-                return dotLine.dotNumber
-    return -1
+def sqlText(text):
+    return text.decode('utf-8', 'replace')   # sqlite3 does not accept 8 bit byte strings
+
+def sqlValue(text):
+    # the values of the views are stored as integers or reals if possible, so that they can be compared and summed up in SQL
+    if not text:
+        return None
+    if is_integer(text) and abs(int(text)) < 2**63:
+        return int(text)
+    if is_number(text):
+        return float(text)
+    return sqlText(text)
 
 def checkAndConvertBooleanFlag(boolean, flagstring):     
     boolean = boolean.lower()
@@ -161,6 +814,30 @@ def checkAndConvertBooleanFlag(boolean, flagstring):
     return boolean
     
 def cdtrace():
+    # the trace folder is found from the environment of <sid>adm, like the cdtrace alias does, only if that is not possible 
+    # the alias is read from an interactive bash (slow, since it loads the whole profile), the result is cached
+    if not 'path' in cdtraceCache:
+        cdtraceCache['path'] = traceDirectoryFromEnvironment() or cdtraceFromAlias()
+    return cdtraceCache['path']
+
+def traceDirectoryFromEnvironment():
+    # cdtrace is the alias 'cd $DIR_INSTANCE/$VTHOSTNAME/trace', and SAP_RETRIEVAL_PATH is $DIR_INSTANCE/$VTHOSTNAME
+    hostname = os.environ.get('VTHOSTNAME') or socket.gethostname().split('.')[0]
+    instanceDirectories = []
+    if os.environ.get('SAP_RETRIEVAL_PATH') and os.path.isdir(os.path.join(os.environ['SAP_RETRIEVAL_PATH'], 'trace')):
+        return os.path.join(os.environ['SAP_RETRIEVAL_PATH'], 'trace')
+    if os.environ.get('DIR_INSTANCE'):
+        instanceDirectories = [os.environ['DIR_INSTANCE']]
+    elif os.environ.get('SAPSYSTEMNAME'):   # /usr/sap/<SID>/HDB<instance number>
+        systemDirectory = os.path.join('/usr/sap', os.environ['SAPSYSTEMNAME'])
+        if os.path.isdir(systemDirectory):
+            instanceDirectories = [os.path.join(systemDirectory, name) for name in sorted(os.listdir(systemDirectory)) if fnmatch.fnmatch(name, 'HDB[0-9][0-9]')]
+    for instanceDirectory in instanceDirectories:
+        if os.path.isdir(os.path.join(instanceDirectory, hostname, 'trace')):
+            return os.path.join(instanceDirectory, hostname, 'trace')
+    return ''
+
+def cdtraceFromAlias():
     command_run = subprocess.check_output(['/bin/bash', '-i', '-c', "alias cdtrace"])
     pieces = command_run.strip("\n").strip("alias cdtrace=").strip("'").strip("cd ").split("/")
     path = ''
@@ -189,69 +866,179 @@ def cdtrace():
 #        print "WARNING: The file "+dumpfile+" has no short stack section."
 #    return stackLines
     
-def readSectionLines(dumpfile, section):
-    if section[0] != '[' and section[-1] != ']':
-        print "ERROR: section does not start and end with square brackets."
-        os._exit(1)
-    inSection = False
-    sectionLines = []
+def openDumpFile(dumpfile):
+    # compressed dump files are decompressed while they are read
     try:
-        with open(dumpfile, 'r') as fin:
-            for line in fin:
-                if not inSection and section in line and 'Local' in line:
-                    inSection = True
-                if inSection and '[OK]' in line:
-                    inSection = False
-                if inSection:
-                    sectionLines.append(line)
-    except:
-        print "ERROR: The file "+dumpfile+" could not be opened."
-        os._exit(1)
-    if not sectionLines:
-        print "WARNING: The file "+dumpfile+" has no "+section+" section."
-    return sectionLines
+        if dumpfile.endswith('.gz'):
+            return io.BufferedReader(gzip.open(dumpfile, 'rb'))
+        if dumpfile.endswith('.bz2'):
+            return bz2.BZ2File(dumpfile, 'r')
+        if dumpfile.endswith('.xz'):
+            if lzma is None:
+                raise DumpFileError("The file "+dumpfile+" is xz compressed but the lzma module is not available (e.g. pip install backports.lzma).")
+            return lzma.open(dumpfile, 'rb')
+        return open(dumpfile, 'r')
+    except (IOError, OSError):
+        raise DumpFileError("The file "+dumpfile+" could not be opened.")
+
+def scanSections(dumpfile, sectionConsumers, stopEarly = False):
+    # walks the dump file once, every line of a requested section is handed to the consumer of that section 
+    # (sectionConsumers is a list of [section, consumer]), and the byte offsets of all [SECTION] headers 
+    # and their [OK] terminators are recorded on the way, with stopEarly the reading stops when all requested sections were read
+    for [section, consumer] in sectionConsumers:
+        if section[0] != '[' and section[-1] != ']':
+            raise DumpFileError("section does not start and end with square brackets.")
+    inSection = [False]*len(sectionConsumers)
+    nSectionLines = [0]*len(sectionConsumers)
+    sectionDone = [False]*len(sectionConsumers)
+    sectionOffsets = []   # [section, offset of header line, offset of [OK] line]
+    openSection = None
+    offset = 0
+    readWholeFile = False
+    fin = openDumpFile(dumpfile)
+    with fin:
+        for line in fin:
+            if '[' in line:   # both section headers and [OK] terminators contain a square bracket
+                if openSection is None and line.startswith('[') and 'Local' in line:
+                    openSection = [line[:line.find(']')+1], offset, -1]
+                    sectionOffsets.append(openSection)
+                elif openSection is not None and '[OK]' in line:
+                    openSection[2] = offset
+                    openSection = None
+                for i in range(len(sectionConsumers)):
+                    if not inSection[i] and sectionConsumers[i][0] in line and 'Local' in line:
+                        inSection[i] = True
+                    if inSection[i] and '[OK]' in line:
+                        inSection[i] = False
+                        sectionDone[i] = True
+                if stopEarly and sectionConsumers and all(sectionDone) and not any(inSection):
+                    break
+            for i in range(len(sectionConsumers)):
+                if inSection[i]:
+                    sectionConsumers[i][1](line)
+                    nSectionLines[i] += 1
+            offset += len(line)
+        else:
+            readWholeFile = True
+    if openSection is not None:
+        openSection[2] = offset
+    warnMissingSections(dumpfile, sectionConsumers, nSectionLines)
+    return [sectionOffsets, readWholeFile, offset]
+
+def warnMissingSections(dumpfile, sectionConsumers, nSectionLines):
+    for i in range(len(sectionConsumers)):
+        if not nSectionLines[i]:
+            print "WARNING: The file "+dumpfile+" has no "+sectionConsumers[i][0]+" section."
+
+def isCompressed(dumpfile):
+    return dumpfile.endswith('.gz') or dumpfile.endswith('.bz2') or dumpfile.endswith('.xz')
+
+def sectionIndexFileName(dumpfile, out_dir):
+    return os.path.join(out_dir, dumpfile[dumpfile.rfind(os.path.sep)+1:]+".idx")
+
+def dumpFileSignature(dumpfile):
+    # a saved index (or cache) of a dump file is only valid as long as the dump file has the same path, size and modification time 
+    dumpStat = os.stat(dumpfile)
+    return [os.path.abspath(dumpfile), dumpStat.st_size, dumpStat.st_mtime]
+
+def readSectionIndex(dumpfile, out_dir):
+    try:
+        with open(sectionIndexFileName(dumpfile, out_dir), 'r') as indexfile:
+            index = json.load(indexfile)
+        if index['signature'] != dumpFileSignature(dumpfile):
+            return None
+        return index['sections']
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+def writeSectionIndex(dumpfile, out_dir, sectionOffsets):
+    try:
+        with open(sectionIndexFileName(dumpfile, out_dir), 'w') as indexfile:
+            json.dump({'signature':dumpFileSignature(dumpfile), 'sections':sectionOffsets}, indexfile)
+    except (IOError, OSError):
+        print "WARNING: The section index of "+dumpfile+" could not be written to "+out_dir
+
+def readIndexedSections(dumpfile, sectionConsumers, sectionOffsets):
+    # seeks directly to the requested sections and returns the number of bytes read, 
+    # returns -1 (before anything is handed to the consumers) if the index does not fit the dump file
+    try:
+        fin = open(dumpfile, 'r')
+    except IOError:
+        raise DumpFileError("The file "+dumpfile+" could not be opened.")
+    with fin:
+        for [section, start, end] in sectionOffsets:
+            fin.seek(start)
+            header = fin.readline()
+            if not header.startswith(section) or not 'Local' in header:
+                return -1
+        nSectionLines = [0]*len(sectionConsumers)
+        bytesRead = 0
+        for i in range(len(sectionConsumers)):
+            for [section, start, end] in sectionOffsets:
+                if section == sectionConsumers[i][0]:
+                    fin.seek(start)
+                    offset = start
+                    while offset < end:
+                        line = fin.readline()
+                        if not line:
+                            break
+                        sectionConsumers[i][1](line)
+                        nSectionLines[i] += 1
+                        offset += len(line)
+                    bytesRead += offset - start
+    warnMissingSections(dumpfile, sectionConsumers, nSectionLines)
+    return bytesRead
+
+def readDumpSections(dumpfile, sectionConsumers, options):
+    # returns the number of (decompressed) bytes read
+    useIndex = options['sectionIndex'] and not isCompressed(dumpfile)
+    if useIndex:
+        sectionOffsets = readSectionIndex(dumpfile, options['out_dir'])
+        if sectionOffsets is not None:
+            bytesRead = readIndexedSections(dumpfile, sectionConsumers, sectionOffsets)
+            if bytesRead >= 0:
+                return bytesRead
+    [sectionOffsets, readWholeFile, bytesRead] = scanSections(dumpfile, sectionConsumers, options['stopEarly'])
+    if useIndex and readWholeFile:   # an index from an early stopped scan would miss the sections at the end of the file
+        writeSectionIndex(dumpfile, options['out_dir'], sectionOffsets)
+    return bytesRead
+
+def readSections(dumpfile, sections):
+    sectionLines = dict((section, []) for section in sections)
+    sectionOffsets = scanSections(dumpfile, [[section, sectionLines[section].append] for section in sections])[0]
+    return [sectionLines, sectionOffsets]
+
+def readSectionLines(dumpfile, section):
+    return readSections(dumpfile, [section])[0][section]
     
 def createThreads(stackLines):
-    inThread = False
     threads = []
-    nNormalThreads = 0
-    nExceptThreads = 0
+    threadParser = ThreadParser(threads.append)
     for line in stackLines:
-        threadStart = '[thr=' in line and not 'inactive' in line
-        exceptStart = 'Allocation failed' in line
-        threadStop = line == '--\n' or ('exception' in line and 'no.' in line)
-        exceptStop = line == '\n' or line == '--\n'
-        exceptFirst = 'exception throw location' in line
-        if not inThread and (threadStart or exceptStart):
-            inThread = True
-            if threadStart:
-                threadId = line.split('[thr=')[1].split(']: ')[0]
-                threadType = line.split(']: ')[1].split(' at')[0]
-                nNormalThreads += 1
-            else: 
-                threadId = str(nExceptThreads)
-                threadType = line.strip(' ').replace('$','').replace('\n','') #aka reason
-                nExceptThreads += 1
-            thread = StackThread(threadId, threadType)
-            if exceptStart:
-                thread.isException = True
-            threads.append(thread)
-        elif inThread and (threadStop or exceptStop):
-            inThread = False
-        elif inThread and not exceptFirst:
-            if not ' in ' in line:
-                print "ERROR: Something went wrong, in thread the line should here be a normal stack line, i.e. include ' in ', line = \n", line
-                os._exit(1)       
-            threads[len(threads)-1].add_line(line)
-    if not threads:
-        print "ERROR: No threads were created"
-        os._exit(1)
-    return [threads, nNormalThreads, nExceptThreads]
+        threadParser.add_line(line)
+    threadParser.finish()
+    return [threads, threadParser.nNormalThreads, threadParser.nExceptThreads]
             
+def stackFrame(stackLine):
+    # the stack line without its frame number, e.g. '  3: 0x00007f in syscall+0x18 (libc.so.6)' --> '0x00007f in syscall+0x18 (libc.so.6)'
+    stackLine = stackLine.lstrip(' ')
+    return stackLine[stackLine.find(' ')+1:]
+
 def splitStackLine(stackLine, functionLength, removeHexFromFunction):
-    splitter = ' in unsigned long ' if ' in unsigned long ' in stackLine else ' in '
-    stackLineId = stackLine.split(splitter)[0].strip(' ').split(' ')[1]
-    stackLineFunction = stackLine.split(splitter)[1].strip(' ')
+    return splitStackFrame(stackFrame(stackLine), functionLength, removeHexFromFunction)
+
+def splitStackFrame(frame, functionLength, removeHexFromFunction):
+    key = (frame, functionLength, removeHexFromFunction)
+    splitFrame = frameCache.lookup(key)
+    if splitFrame is None:
+        splitFrame = parseStackFrame(frame, functionLength, removeHexFromFunction)
+        frameCache.store(key, splitFrame)
+    return splitFrame
+
+def parseStackFrame(frame, functionLength, removeHexFromFunction):
+    splitter = ' in unsigned long ' if ' in unsigned long ' in frame else ' in '
+    stackLineId = frame.split(splitter)[0].rstrip(' ').split(' ')[0]
+    stackLineFunction = frame.split(splitter)[1].strip(' ')
     if functionLength < 0:
         stackLineFunction = stackLineFunction.split('(')[0]
     else:
@@ -268,53 +1055,159 @@ def splitStackLine(stackLine, functionLength, removeHexFromFunction):
     stackLineFunction = stackLineFunction.replace('<','&lt;').replace('>','&gt;').strip('\n')
     return [stackLineId, stackLineFunction]
 
+def cleanZNFunction(function):
+    cleanFunction = znFunctionCache.lookup(function)
+    if cleanFunction is None:
+        cleanFunction = function.split('ER')[0].strip('_ZNK').strip('_ZN')
+        cleanFunction = "".join(["::" if char.isdigit() else char for char in cleanFunction])
+        cleanFunction = cleanFunction.replace('::::','::').strip('::')
+        znFunctionCache.store(function, cleanFunction)
+    return cleanFunction
+
 def createDotLines(threads, plot_threads, functionLength, removeHexFromFunction, id_by_function):
-    dotLineNumber = 0
-    dotLines = []
-    maxNbrThreads = 0
+    dotGraph = DotGraph(plot_threads, functionLength, removeHexFromFunction, id_by_function)
     for thread in threads:
-        dotLineNumberOfPrevStackLine = -1
-        if plot_threads:
-            dotLine = DotLine(dotLineNumber, thread.id, thread.type)
-            dotLine.add_parent(dotLineNumberOfPrevStackLine)   
-            dotLine.add_thread(thread.id)
-            dotLine.setIsThread(not thread.isException)
-            dotLine.setIsException(thread.isException)
-            dotLines.append(dotLine)
-            dotLineNumberOfPrevStackLine = dotLineNumber
-            dotLineNumber += 1   # dotLineNumber is also the index in dotLines
-        for stackLine in thread.lines:
-            [stackLineId, stackLineFunction] = splitStackLine(stackLine, functionLength, removeHexFromFunction)
-            searchId = stackLineFunction if id_by_function else stackLineId
-            dotLineNumberWithThisDotId = findDotLineNumber(searchId, dotLines)
-            if dotLineNumberWithThisDotId < 0:  #then there is no dotline from this stackline yet
-                dotLine = DotLine(dotLineNumber, stackLineId, stackLineFunction, id_by_function)
-                dotLine.add_parent(dotLineNumberOfPrevStackLine)
-                dotLine.add_thread(thread.id)
-                maxNbrThreads = max(len(dotLine.usedByThreads), maxNbrThreads)
-                dotLines.append(dotLine)
-                dotLineNumberOfPrevStackLine = dotLineNumber
-                dotLineNumber += 1   # dotLineId is also the index in dotLines
-            else:
-                dotLines[dotLineNumberWithThisDotId].add_parent_if_not_listed(dotLineNumberOfPrevStackLine)
-                dotLines[dotLineNumberWithThisDotId].add_thread_if_not_listed(thread.id)
-                maxNbrThreads = max(len(dotLines[dotLineNumberWithThisDotId].usedByThreads), maxNbrThreads)
-                dotLineNumberOfPrevStackLine = dotLineNumberWithThisDotId
-    if not dotLines:
-        print "ERROR: No dot lines were created"
-        os._exit(1)
-    if not maxNbrThreads:
-        print "ERROR: maxNbrThreads = ", maxNbrThreads
-        os._exit(1)
-    return [dotLines, maxNbrThreads]
+        dotGraph.add_thread(thread)
+    dotGraph.checkDotLines()
+    return [dotGraph.dotLines, dotGraph.maxNbrThreads]
+
+def pruneDotGraph(dotGraph, topPaths, minThreads, collapseChains):
+    # returns the dot lines that should be written, the parents of the kept dot lines are changed accordingly
+    dotLines = dotGraph.dotLines
+    if not topPaths and minThreads <= 1 and not collapseChains:
+        return dotLines
+    keptEdges = None   # None: all edges between kept dot lines are kept
+    if topPaths:
+        keptNumbers = set()
+        keptEdges = set()
+        for [path, pathCount] in sorted(dotGraph.pathCounts.items(), key = lambda pathAndCount: (-pathAndCount[1][0], pathAndCount[1][1]))[:topPaths]:
+            keptNumbers.update(path)
+            keptEdges.update(zip(path[1:], path[:-1]))
+    else:
+        keptNumbers = set(range(len(dotLines)))
+    if minThreads > 1:
+        keptNumbers = set([n for n in keptNumbers if dotLines[n].isThread or dotLines[n].isException or dotLines[n].nbrThreads() >= minThreads])
+    for n in keptNumbers:
+        dotLine = dotLines[n]
+        parents = [p for p in dotLine.parentDotNumbers if p == -1 or (p in keptNumbers and (keptEdges is None or (n, p) in keptEdges))]
+        dotLine.parentDotNumbers = parents if parents else [-1]   # a dot line that lost all its parents becomes a root
+        dotLine.parentDotNumberSet = None
+    usedParents = set([p for n in keptNumbers for p in dotLines[n].parentDotNumbers])
+    keptNumbers = set([n for n in keptNumbers if not (dotLines[n].isThread or dotLines[n].isException) or n in usedParents])
+    if collapseChains:
+        nChildren = {}
+        for n in keptNumbers:
+            for p in dotLines[n].parentDotNumbers:
+                nChildren[p] = nChildren.get(p, 0) + 1
+        chainChild = {}   # dot number --> the dot number of its only child, if they are collapsed
+        for n in sorted(keptNumbers):
+            dotLine = dotLines[n]
+            if len(dotLine.parentDotNumbers) == 1 and dotLine.parentDotNumbers[0] != -1 and not (dotLine.isThread or dotLine.isException):
+                parent = dotLines[dotLine.parentDotNumbers[0]]
+                if nChildren.get(parent.dotNumber) == 1 and not (parent.isThread or parent.isException) and dotLine.hasSameThreads(parent):
+                    chainChild[parent.dotNumber] = n
+        chainHead = {}
+        chainChildren = set(chainChild.values())
+        for n in sorted(keptNumbers):
+            if n in chainChild and not n in chainChildren:
+                functions = [dotLines[n].function]
+                stackIds = [dotLines[n].stackThreadId]
+                child = chainChild.get(n)
+                while child is not None:
+                    chainHead[child] = n
+                    functions.append(dotLines[child].function)
+                    stackIds.append(dotLines[child].stackThreadId)
+                    child = chainChild.get(child)
+                dotLines[n].function = r'\n'.join(functions)
+                dotLines[n].stackThreadId = ', '.join(stackIds)
+        for n in keptNumbers:
+            dotLines[n].parentDotNumbers = [chainHead.get(p, p) for p in dotLines[n].parentDotNumbers]
+        keptNumbers = keptNumbers - set(chainHead)
+    return [dotLine for dotLine in dotLines if dotLine.dotNumber in keptNumbers]
+
+def openOutputFile(outfilename, compressOutput = False):
+    if compressOutput:
+        return gzip.open(outfilename, "wb", 6)   # the default level 9 is much slower for hardly smaller files
+    return open(outfilename, "w")
+
+def plainFunction(function):
+    # the function of a dot line without the escaping for the dot files, see parseStackFrame
+    return function.replace('&lt;', '<').replace('&gt;', '>')
+
+def writeFoldedFile(dotGraph, outfilename, compressOutput = False):
+    # one line per distinct stack, as read by flame graph tools, the paths of the dot graph are from the innermost frame
+    if compressOutput:
+        outfilename += ".gz"
+    stackCounts = {}   # with -if false different dot lines can have the same function, then their stacks are merged
+    stackOrder = []
+    for [path, [pathCount, firstSeen]] in sorted(dotGraph.pathCounts.items(), key = lambda pathAndCount: pathAndCount[1][1]):
+        stack = ';'.join([plainFunction(dotGraph.dotLines[n].function).replace(';', ':') for n in reversed(path)])
+        if not stack in stackCounts:
+            stackCounts[stack] = 0
+            stackOrder.append(stack)
+        stackCounts[stack] += pathCount
+    foldedfile = openOutputFile(outfilename, compressOutput)
+    writeInBatches(foldedfile, (stack+' '+str(stackCounts[stack])+'\n' for stack in stackOrder))
+    foldedfile.close()
+    print "File "+outfilename+" was created"
+
+def jsonNode(dotLine, dumpNames = None):
+    node = {'id':dotLine.dotNumber, 'function':plainFunction(dotLine.function), 'stackId':dotLine.stackThreadId, 'threads':dotLine.nbrThreads(), 
+            'type':'thread' if dotLine.isThread else ('exception' if dotLine.isException else 'stack')}
+    if dotLine.parentDotNumbers[0] == -1:
+        node['root'] = True
+    if dumpNames is not None:
+        node['dumps'] = dict([[dumpNames[dumpIndex].split('/')[-1], dotLine.dumpThreadCounts[dumpIndex]] for dumpIndex in dotLine.dumpThreadCounts])
+    return node
+
+def writeJsonGraphFile(dotLines, graphInfo, outfilename, ndjson = False, compressOutput = False, dumpNames = None):
+    # json: one object with the nodes and the edges (as [from, to] pairs), ndjson: one object per line, first the graph info, 
+    # then the nodes, then the edges, dumpNames is only given for aggregated graphs
+    if compressOutput:
+        outfilename += ".gz"
+    writtenDotNumbers = set([dotLine.dotNumber for dotLine in dotLines])
+    edges = ([dotLine.dotNumber, parentDotNumber] for dotLine in dotLines for parentDotNumber in dotLine.parentDotNumbers if parentDotNumber in writtenDotNumbers)
+    toJson = lambda item: json.dumps(item, separators = (',', ':'), sort_keys = True)
+    jsonfile = openOutputFile(outfilename, compressOutput)
+    if ndjson:
+        jsonfile.write(toJson(dict(graphInfo, kind = 'graph'))+'\n')
+        writeInBatches(jsonfile, (toJson(dict(jsonNode(dotLine, dumpNames), kind = 'node'))+'\n' for dotLine in dotLines))
+        writeInBatches(jsonfile, (toJson({'kind':'edge', 'from':edge[0], 'to':edge[1]})+'\n' for edge in edges))
+    else:
+        jsonfile.write(toJson(graphInfo)[:-1]+',"nodes":[')
+        writeInBatches(jsonfile, ((',' if i else '')+toJson(jsonNode(dotLine, dumpNames)) for [i, dotLine] in enumerate(dotLines)))
+        jsonfile.write('],"edges":[')
+        writeInBatches(jsonfile, ((',' if i else '')+toJson(edge) for [i, edge] in enumerate(edges)))
+        jsonfile.write(']}\n')
+    jsonfile.close()
+    print "File "+outfilename+" was created"
 
-def writeDotFile(dotLines, maxNbrThreads, plot_threads, plot_stack_id, nNormalThreads, nExceptThreads, dumpfile, out_dir):
+def writeInBatches(outfile, texts, batchSize = 10000):
+    # many small writes are slow, so the texts are joined and written in large chunks
+    batch = []
+    for text in texts:
+        batch.append(text)
+        if len(batch) >= batchSize:
+            outfile.write(''.join(batch))
+            batch = []
+    if batch:
+        outfile.write(''.join(batch))
+
+def dotNodeText(dotLine, maxNbrThreads, plot_threads, plot_stack_id):
+    if plot_threads and dotLine.isThread:
+        return "nC"+str(dotLine.dotNumber)+"\n"+'[shape=record,label="{Thread ID: '+dotLine.stackThreadId + r'\nThread Type: '+dotLine.function+'}",style=filled,fillcolor="'+dotLine.color()+'",fontname=sans];\n'
+    if plot_threads and dotLine.isException:
+        return "nC"+str(dotLine.dotNumber)+"\n"+'[shape=record,label="{Exception ID: '+dotLine.stackThreadId + r'\nReason: '+dotLine.function+'}",style=filled,fillcolor="'+dotLine.color()+'",fontname=sans];\n'
+    id_and_func = dotLine.function + r'\n' + dotLine.stackThreadId if plot_stack_id else dotLine.function
+    rootStyle = 'color=blue,penwidth=5,' if not plot_threads and dotLine.parentDotNumbers[0] == -1 else ''
+    return "nC"+str(dotLine.dotNumber)+"\n"+'[shape=record,'+rootStyle+'label="{'+id_and_func+ r'\n#T='+str(len(dotLine.usedByThreads))+'}",style=filled,fillcolor="'+dotLine.color(maxNbrThreads)+'",fontname=sans];\n'
+
+def writeDotFile(dotLines, maxNbrThreads, plot_threads, plot_stack_id, nNormalThreads, nExceptThreads, dumpfile, out_dir, compressOutput = False):
     #outfilename = out_dir+"/"+dumpfile.split('/')[-1]+".dot"    
     outfilename = os.path.join(out_dir,dumpfile[dumpfile.rfind(os.path.sep)+1:]+".dot")     
-    dotfile = open(outfilename, "w")
-    dotfile.write("digraph StackGraph {\n")
-    dotfile.write("ratio=compress\n")  
-    dotfile.write("rankdir=BT\n")        # maybe skipp this line
+    if compressOutput:
+        outfilename += ".gz"
+    dotfile = openOutputFile(outfilename, compressOutput)
     normalThreadLegend = ''
     exceptThreadLegend = ''
     if plot_threads:
@@ -322,39 +1215,153 @@ def writeDotFile(dotLines, maxNbrThreads, plot_threads, plot_stack_id, nNormalTh
             normalThreadLegend = '|{'+str(nNormalThreads)+' Normal Threads (cyan boxes)}'
         if nExceptThreads:
             exceptThreadLegend = '|{'+str(nExceptThreads)+' Exception Threads (orange boxes)}'
-    dotfile.write('nlegend [shape=record,label="{{#T = Number threads executing the stack process}'+normalThreadLegend+exceptThreadLegend+'}",style=filled,fillcolor="#ffff00",fontname=sans];\n')
-    for dotLine in dotLines:
-        dotfile.write("nC"+str(dotLine.dotNumber)+"\n")
-        if plot_threads and dotLine.isThread:
-            dotfile.write('[shape=record,label="{Thread ID: '+dotLine.stackThreadId + r'\nThread Type: '+dotLine.function+'}",style=filled,fillcolor="'+dotLine.color()+'",fontname=sans];\n')
-        elif plot_threads and dotLine.isException:
-            dotfile.write('[shape=record,label="{Exception ID: '+dotLine.stackThreadId + r'\nReason: '+dotLine.function+'}",style=filled,fillcolor="'+dotLine.color()+'",fontname=sans];\n')
-        elif not plot_threads and dotLine.parentDotNumbers[0] == -1:
-            id_and_func = dotLine.function + r'\n' + dotLine.stackThreadId if plot_stack_id else dotLine.function
-            dotfile.write('[shape=record,color=blue,penwidth=5,label="{'+id_and_func+ r'\n#T='+str(len(dotLine.usedByThreads))+'}",style=filled,fillcolor="'+dotLine.color(maxNbrThreads)+'",fontname=sans];\n')
-        else:
-            id_and_func = dotLine.function + r'\n' + dotLine.stackThreadId if plot_stack_id else dotLine.function
-            dotfile.write('[shape=record,label="{'+id_and_func+ r'\n#T='+str(len(dotLine.usedByThreads))+'}",style=filled,fillcolor="'+dotLine.color(maxNbrThreads)+'",fontname=sans];\n')
-    for dotLine in dotLines:
-        for parentDotNumber in dotLine.parentDotNumbers:
-            if not parentDotNumber == -1:
-                dotfile.write('nC'+str(dotLine.dotNumber)+' -> nC'+str(parentDotNumber)+'\n')
+    dotfile.write("digraph StackGraph {\n" + 
+                  "ratio=compress\n" + 
+                  "rankdir=BT\n" +       # maybe skipp this line
+                  'nlegend [shape=record,label="{{#T = Number threads executing the stack process}'+normalThreadLegend+exceptThreadLegend+'}",style=filled,fillcolor="#ffff00",fontname=sans];\n')
+    writeInBatches(dotfile, (dotNodeText(dotLine, maxNbrThreads, plot_threads, plot_stack_id) for dotLine in dotLines))
+    writeInBatches(dotfile, ('nC'+str(dotLine.dotNumber)+' -> nC'+str(parentDotNumber)+'\n' for dotLine in dotLines for parentDotNumber in dotLine.parentDotNumbers if not parentDotNumber == -1))
+    dotfile.write('}')
+    dotfile.close()
+    print "File "+outfilename+" was created"    
+
+def writeAggregatedDotFile(dotGraph, dotLines, colorByDumps, plot_stack_id, out_dir, compressOutput = False):
+    outfilename = os.path.join(out_dir, "aggregated_stack_graph.dot")
+    if compressOutput:
+        outfilename += ".gz"
+    dotfile = openOutputFile(outfilename, compressOutput)
+    dotLines = [dotLine for dotLine in dotLines if dotLine.nbrDumps()]   # dot lines only from dump files that could not be processed are skipped
+    writtenDotNumbers = set([dotLine.dotNumber for dotLine in dotLines])
+    maxNbrThreads = max([dotLine.totalThreads() for dotLine in dotLines])
+    nDumps = len(dotGraph.dumpNames)
+    dotfile.write("digraph StackGraph {\n" + 
+                  "ratio=compress\n" + 
+                  "rankdir=BT\n" + 
+                  'nlegend [shape=record,label="{{#T = Number threads executing the stack process in all dump files}|{#D = Number dump files with the stack process}|{'+str(nDumps)+' Dump Files}}",style=filled,fillcolor="#ffff00",fontname=sans];\n')
+    def nodeText(dotLine):
+        id_and_func = dotLine.function + r'\n' + dotLine.stackThreadId if plot_stack_id else dotLine.function
+        rootStyle = 'color=blue,penwidth=5,' if dotLine.parentDotNumbers[0] == -1 else ''
+        color = dotLine.color(nDumps, dotLine.nbrDumps()) if colorByDumps else dotLine.color(maxNbrThreads, dotLine.totalThreads())
+        tooltip = ', '.join([dotGraph.dumpNames[dumpIndex].split('/')[-1]+': '+str(dotLine.dumpThreadCounts[dumpIndex]) for dumpIndex in sorted(dotLine.dumpThreadCounts)])
+        return ("nC"+str(dotLine.dotNumber)+"\n"+'[shape=record,'+rootStyle+'label="{'+id_and_func+ r'\n#T='+str(dotLine.totalThreads())+r'\n#D='+str(dotLine.nbrDumps())+'}",'
+                +'tooltip="'+tooltip+'",style=filled,fillcolor="'+color+'",fontname=sans];\n')
+    writeInBatches(dotfile, (nodeText(dotLine) for dotLine in dotLines))
+    writeInBatches(dotfile, ('nC'+str(dotLine.dotNumber)+' -> nC'+str(parentDotNumber)+'\n' for dotLine in dotLines for parentDotNumber in dotLine.parentDotNumbers if parentDotNumber in writtenDotNumbers))
     dotfile.write('}')
     dotfile.close()
     print "File "+outfilename+" was created"    
 
-def makeWaitGraph(dumpfile, out_dir):
-    waitLines = readSectionLines(dumpfile, '[INDEXMANAGER_WAITGRAPH]')
-    waitfile = open(out_dir+'/indexmanager_waitgraph_'+dumpfile.replace('.','_')+'.dot', "w")
+def threadCountDelta(dumpThreadCounts, dumpIndices):
+    # [threads in the first dump file, threads in the second dump file] of a dot line or an edge of a diff graph, 
+    # dumpIndices are the dump indices in the graph of the first and the second dump file of -df
+    if not dumpThreadCounts:
+        return [0, 0]
+    return [dumpThreadCounts.get(dumpIndices[0], 0), dumpThreadCounts.get(dumpIndices[1], 0)]
+
+def diffColor(delta, maxAbsDelta):
+    scale = DotLine.red_scale if delta > 0 else DotLine.blue_scale
+    return scale[int(float(abs(delta)) / float(max(maxAbsDelta, 1)) * (len(scale)-1))]
+
+def diffDumpIndices(dotGraph, dumpfiles):
+    # the dump indices in the graph of the dump files of -df, in the order of -df, None if not all of them were added to 
+    # the graph (e.g. a dump file without a [STACK_SHORT] section)
+    dumpIndices = []
+    for dumpfile in dumpfiles:
+        dumpIndex = [i for i in range(len(dotGraph.dumpNames)) if dotGraph.dumpNames[i] == dumpfile and not i in dumpIndices]
+        if not dumpIndex:
+            return None
+        dumpIndices.append(dumpIndex[0])
+    return dumpIndices
+
+def writeDiffDotFile(dotGraph, dumpIndices, plot_stack_id, nMovers, out_dir, compressOutput = False):
+    # the two dump files are in one aggregated graph, so the stack processes are matched by the hashed IDs of the graph (see -if),
+    # and the threads per stack process and per call (edge) are already counted per dump file
+    [firstName, secondName] = [dotGraph.dumpNames[dumpIndex].split('/')[-1] for dumpIndex in dumpIndices]
+    dotLines = [dotLine for dotLine in dotGraph.dotLines if dotLine.nbrDumps()]
+    nodeCounts = dict([[dotLine.dotNumber, threadCountDelta(dotLine.dumpThreadCounts, dumpIndices)] for dotLine in dotLines])
+    edgeCounts = dict([[edge, threadCountDelta(dumpThreadCounts, dumpIndices)] for [edge, dumpThreadCounts] in dotGraph.edgeThreadCounts.items() if dumpThreadCounts])
+    maxAbsDelta = max([abs(second - first) for [first, second] in nodeCounts.values()])
+    outfilename = os.path.join(out_dir, "diff_stack_graph.dot")
+    if compressOutput:
+        outfilename += ".gz"
+    dotfile = openOutputFile(outfilename, compressOutput)
+    dotfile.write("digraph StackGraph {\n" + 
+                  "ratio=compress\n" + 
+                  "rankdir=BT\n" + 
+                  'nlegend [shape=record,label="{{#T = Number threads in '+firstName+' -\\> '+secondName+'}|{red: more threads, blue: less threads}}",style=filled,fillcolor="#ffff00",fontname=sans];\n')
+    def nodeText(dotLine):
+        [first, second] = nodeCounts[dotLine.dotNumber]
+        id_and_func = dotLine.function + r'\n' + dotLine.stackThreadId if plot_stack_id else dotLine.function
+        rootStyle = 'color=blue,penwidth=5,' if dotLine.parentDotNumbers[0] == -1 else ''
+        return ("nC"+str(dotLine.dotNumber)+"\n"+'[shape=record,'+rootStyle+'label="{'+id_and_func+r'\n#T='+str(first)+' -\\> '+str(second)+' ('+('%+d' % (second - first))+')}",'
+                +'style=filled,fillcolor="'+diffColor(second - first, maxAbsDelta)+'",fontname=sans];\n')
+    def edgeText(edge):
+        [first, second] = edgeCounts[edge]
+        color = '#ff0000' if second > first else ('#0000ff' if second < first else '#000000')
+        return 'nC'+str(edge[0])+' -> nC'+str(edge[1])+' [label="'+('%+d' % (second - first))+'",color="'+color+'"]\n' if second != first else 'nC'+str(edge[0])+' -> nC'+str(edge[1])+'\n'
+    writeInBatches(dotfile, (nodeText(dotLine) for dotLine in dotLines))
+    writeInBatches(dotfile, (edgeText(edge) for edge in sorted(edgeCounts)))
+    dotfile.write('}')
+    dotfile.close()
+    print "File "+outfilename+" was created"
+    byDelta = lambda counts: (-abs(counts[1][1] - counts[1][0]), counts[0])
+    movers = [item for item in sorted(nodeCounts.items(), key = byDelta) if item[1][0] != item[1][1]][:nMovers]
+    print "Stack processes with the largest change of threads from "+firstName+" to "+secondName+":"
+    for [dotNumber, [first, second]] in movers:
+        print "  %+6d  (%d -> %d)  %s" % (second - first, first, second, plainFunction(dotGraph.dotLines[dotNumber].function))
+    movers = [item for item in sorted(edgeCounts.items(), key = byDelta) if item[1][0] != item[1][1]][:nMovers]
+    print "Calls with the largest change of threads from "+firstName+" to "+secondName+":"
+    for [[dotNumber, parentDotNumber], [first, second]] in movers:
+        print "  %+6d  (%d -> %d)  %s  calls  %s" % (second - first, first, second, plainFunction(dotGraph.dotLines[dotNumber].function), plainFunction(dotGraph.dotLines[parentDotNumber].function))
+
+def makeWaitGraph(dumpfile, waitLines, out_dir):
+    waitfile = open(out_dir+'/indexmanager_waitgraph_'+dumpfile.split('/')[-1].replace('.','_')+'.dot', "w")
     for line in waitLines[1:]:
         waitfile.write(line)
     waitfile.close()
 
-def makeViews(dumpfile, out_dir):
+def analyzeWaitGraph(dumpfile, waitLines, nTopBlockers, out_dir):
+    waitGraph = WaitGraph()
+    for line in waitLines:
+        waitGraph.add_line(line)
+    name = dumpfile.split('/')[-1]
+    if not waitGraph.nodeNames:
+        print "WARNING: No waits were found in the [INDEXMANAGER_WAITGRAPH] section of "+dumpfile+", so no wait analysis was done."
+        return waitGraph
+    [cycles, waiterBounds, depths] = waitGraph.analyze()
+    [blockers, waiters, upperBounds] = waitGraph.top_blockers(nTopBlockers, waiterBounds)
+    waiterText = lambda node: ('at most ' if node in upperBounds else '')+str(waiters[node])
+    transaction = lambda node: waitGraph.nodeNames[node].strip('"')
+    label = lambda node: re.sub(r'([{}|<>])', r'\\\1', transaction(node))   # these characters have a meaning in record labels
+    print "Wait analysis of "+name+": "+str(len(waitGraph.nodeNames))+" transactions, "+str(waitGraph.nbrWaits())+" waits, "+str(len(cycles))+" deadlock cycles, longest wait chain: "+str(max(depths))
+    for cycle in cycles:
+        cycleTransactions = sorted([transaction(node) for node in cycle])
+        print "  Deadlock cycle of "+str(len(cycle))+" transactions: "+', '.join(cycleTransactions[:10])+(', ...' if len(cycle) > 10 else '')
+    for node in blockers:
+        print "  Blocker "+transaction(node)+": "+waiterText(node)+" waiting transactions ("+str(waitGraph.nWaiters[node])+" directly), wait chain depth "+str(depths[node])
+    if upperBounds & set(blockers):
+        print "  (the wait graph is too large to count all waiters of the top blockers exactly, 'at most' are upper bounds)"
+    cycleNodes = set([node for cycle in cycles for node in cycle])
+    keptNodes = cycleNodes | set(blockers)
+    outfilename = out_dir+'/indexmanager_waitanalysis_'+name.replace('.','_')+'.dot'
+    waitfile = open(outfilename, "w")
+    waitfile.write("digraph WaitAnalysis {\n" + 
+                   'nlegend [shape=record,label="{{'+str(len(waitGraph.nodeNames))+' Transactions, '+str(waitGraph.nbrWaits())+' Waits}|{'+str(len(cycles))+' Deadlock Cycles (red boxes)}|{Top Blockers (orange boxes)}|{#W = Number transactions waiting'+(', at most if marked with \\<=' if upperBounds & keptNodes else '')+'}}",style=filled,fillcolor="#ffff00",fontname=sans];\n')
+    for node in sorted(keptNodes):
+        color = '#ff0000' if node in cycleNodes else '#ffa500'
+        nodeWaiterText = (r'\n#W\<=' if node in upperBounds else r'\n#W=')+str(waiters[node]) if node in waiters else ''   # only counted for the blockers
+        waitfile.write(waitGraph.nodeNames[node]+' [shape=record,label="{'+label(node)+nodeWaiterText+'}",style=filled,fillcolor="'+color+'",fontname=sans];\n')
+    writeInBatches(waitfile, (waitGraph.nodeNames[waiter]+' -> '+waitGraph.nodeNames[holder]+(' '+attributes if attributes else '')+';\n' 
+                              for [(waiter, holder), attributes] in sorted(waitGraph.edgeAttributes.items()) if waiter in keptNodes and holder in keptNodes))
+    waitfile.write('}\n')
+    waitfile.close()
+    print "File "+outfilename+" was created"
+    return waitGraph
+
+def makeViews(dumpfile, statLines, out_dir):
     view_directory = out_dir+'/VIEWS_'+dumpfile.split('/')[-1].replace('.','_')
     if not os.path.exists(view_directory):
         os.makedirs(view_directory)
-    statLines = readSectionLines(dumpfile, '[STATISTICS]')
     outside_view = True
     for line in statLines:
         if outside_view:
@@ -370,6 +1377,337 @@ def makeViews(dumpfile, out_dir):
         else:  # Inside view
              viewfile.write(line)                       
 
+def resetPeakRSS():
+    # resets the peak memory of the process (VmHWM), only possible on Linux, returns if it was reset
+    try:
+        with open('/proc/self/clear_refs', 'w') as clearRefs:
+            clearRefs.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+def peakRSSMB():
+    # the peak memory since the last resetPeakRSS, if that is not possible the one of the process so far 
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])/1024.0   # kB
+    except (IOError, OSError, ValueError):
+        pass
+    if resource is None:
+        return -1.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/1024.0/1024.0 if sys.platform == 'darwin' else peak/1024.0   # bytes on macOS, KB on Linux
+
+def toolVersion():
+    # a thread cache file is only valid for the hanadumpviewer.py that wrote it
+    global hanadumpviewerVersion
+    if hanadumpviewerVersion is None:
+        with open(os.path.splitext(os.path.abspath(__file__))[0]+'.py', 'rb') as script:
+            hanadumpviewerVersion = hashlib.md5(script.read()).hexdigest()
+    return hanadumpviewerVersion
+hanadumpviewerVersion = None
+
+def threadCacheFileName(dumpfile, out_dir):
+    cacheName = dumpfile[dumpfile.rfind(os.path.sep)+1:]+'.'+hashlib.md5(os.path.abspath(dumpfile)).hexdigest()[:8]+'.threads'
+    return os.path.join(out_dir, 'hanadumpviewer_cache', cacheName)
+
+def readThreadModel(dumpfile, out_dir):
+    # returns [nNormalThreads, nExceptThreads, threads] from the thread cache, or None if there is no valid cache file
+    cacheFileName = threadCacheFileName(dumpfile, out_dir)
+    try:
+        with open(cacheFileName, 'rb') as cachefile:
+            [version, signature, nNormalThreads, nExceptThreads, frames, cachedThreads] = marshal.loads(zlib.decompress(cachefile.read()))
+        if version != toolVersion() or signature != dumpFileSignature(dumpfile):
+            return None
+        os.utime(cacheFileName, None)   # the modification time tells which cache files were least recently used
+    except (IOError, OSError, ValueError, TypeError, EOFError, zlib.error):
+        return None
+    frameTable = FrameTable()
+    frameTable.set_frames(frames)
+    threads = []
+    for [threadId, threadType, isException, frameIds] in cachedThreads:
+        thread = StackThread(threadId, threadType, frameTable)
+        thread.isException = isException
+        thread.frameIds.fromstring(frameIds)
+        threads.append(thread)
+    return [nNormalThreads, nExceptThreads, threads]
+
+def writeThreadModel(dumpfile, out_dir, threadModel, maxCacheSize):
+    [nNormalThreads, nExceptThreads, threads] = threadModel
+    frames = threads[0].frameTable.frames if threads else []
+    cachedThreads = [[thread.id, thread.type, thread.isException, thread.frameIds.tostring()] for thread in threads]
+    cacheFileName = threadCacheFileName(dumpfile, out_dir)
+    try:
+        if not os.path.exists(os.path.dirname(cacheFileName)):
+            os.makedirs(os.path.dirname(cacheFileName))
+        with open(cacheFileName, 'wb') as cachefile:
+            cachefile.write(zlib.compress(marshal.dumps([toolVersion(), dumpFileSignature(dumpfile), nNormalThreads, nExceptThreads, frames, cachedThreads]), 1))
+    except (IOError, OSError):
+        print "WARNING: The threads of "+dumpfile+" could not be written to the thread cache in "+out_dir
+        return
+    try:
+        evictThreadCache(os.path.dirname(cacheFileName), maxCacheSize)
+    except (IOError, OSError):   # a cache problem never makes the dump file fail
+        print "WARNING: The thread cache in "+out_dir+" could not be cleaned up"
+
+def evictThreadCache(cacheDirectory, maxCacheSize):
+    # removes the least recently used cache files until the cache is not larger than maxCacheSize bytes
+    cacheFiles = []
+    for cacheName in os.listdir(cacheDirectory):
+        if cacheName.endswith('.threads'):
+            try:
+                cacheStat = os.stat(os.path.join(cacheDirectory, cacheName))
+            except OSError:   # e.g. just removed by another worker, see -j
+                continue
+            cacheFiles.append([cacheStat.st_mtime, cacheStat.st_size, cacheName])
+    cacheSize = sum([cacheFile[1] for cacheFile in cacheFiles])
+    for [mtime, size, cacheName] in sorted(cacheFiles):
+        if cacheSize <= maxCacheSize:
+            break
+        try:
+            os.remove(os.path.join(cacheDirectory, cacheName))
+            cacheSize -= size
+        except OSError:
+            pass
+
+def processDumpFile(dumpfile, options, aggregateGraph = None, database = None):
+    # everything is done in one single pass through the dump file, the threads of the [STACK_SHORT] section 
+    # are folded into the dot graph (or into aggregateGraph, then no dot file is written) and loaded into 
+    # the database (if -db) while the file is read, returns the profile of the dump file
+    profile = DumpProfile(dumpfile)
+    graphSeconds = [0.0]   # time spent in the dot graph while the file is read
+    frameCache.resize(options['frameCacheSize'])
+    znFunctionCache.resize(options['frameCacheSize'])
+    [frameHitsBefore, frameMissesBefore] = frameCache.stats()
+    sectionConsumers = []
+    parseThreads = options['make_dots'] or database is not None
+    if database is not None:
+        database.begin_dump(dumpfile)
+    if parseThreads:
+        dotGraph = None
+        if options['make_dots'] and aggregateGraph is not None:
+            dotGraph = aggregateGraph
+        elif options['make_dots']:
+            dotGraph = DotGraph(options['plot_threads'], options['functionLength'], options['removeHexFromFunction'], options['id_by_function'], recordPaths = options['topPaths'] > 0 or 'folded' in options['outputFormats'])
+        threadModel = readThreadModel(dumpfile, options['out_dir']) if options['threadCache'] else None
+        if threadModel is not None:   # no need to read the stack section
+            profile.end_stage('read cache', threads = len(threadModel[2]))
+            for thread in threadModel[2]:
+                if dotGraph is not None:
+                    dotGraph.add_thread(thread)
+                if database is not None:
+                    database.add_thread(thread)
+            if dotGraph is not None:
+                profile.end_stage('graph', threads = len(threadModel[2]), nodes = len(dotGraph.dotLines))
+        else:
+            cachedThreads = []
+            def addThread(thread):
+                if dotGraph is not None:
+                    graphStart = time.time()
+                    dotGraph.add_thread(thread)
+                    graphSeconds[0] += time.time() - graphStart
+                if database is not None:
+                    database.add_thread(thread)
+                if options['threadCache']:
+                    cachedThreads.append(thread)
+            threadParser = ThreadParser(addThread)
+            sectionConsumers.append(['[STACK_SHORT]', threadParser.add_line])
+    waitLines = []
+    if options['make_wait_graph'] or options['waitAnalysis']:
+        sectionConsumers.append(['[INDEXMANAGER_WAITGRAPH]', waitLines.append])
+    statLines = []
+    if options['make_views'] or database is not None:
+        sectionConsumers.append(['[STATISTICS]', statLines.append])
+    if sectionConsumers:
+        profile.start_stage()
+        readStart = time.time()
+        bytesRead = readDumpSections(dumpfile, sectionConsumers, options)
+        if parseThreads and threadModel is None and threadParser.nLines:
+            threadParser.finish()
+        readSeconds = time.time() - readStart - graphSeconds[0]
+        nLines = len(waitLines) + len(statLines) + (threadParser.nLines if parseThreads and threadModel is None else 0)
+        nThreads = threadParser.nThreads if parseThreads and threadModel is None else 0
+        profile.end_stage('read and parse', bytesRead, nLines, nThreads, seconds = readSeconds)
+        if options['make_dots'] and threadModel is None:
+            profile.end_stage('graph', threads = nThreads, nodes = len(dotGraph.dotLines), seconds = graphSeconds[0], withPreviousStage = True)
+    if parseThreads and threadModel is None and threadParser.nLines:
+        threadModel = [threadParser.nNormalThreads, threadParser.nExceptThreads, cachedThreads]
+        if options['threadCache']:
+            profile.start_stage()
+            writeThreadModel(dumpfile, options['out_dir'], threadModel, options['threadCacheMaxSize']*1024*1024)
+            profile.end_stage('write cache', threads = len(cachedThreads))
+    if options['make_dots']:
+        if threadModel is not None and aggregateGraph is None:
+            profile.start_stage()
+            dotGraph.checkDotLines()
+            outfilename = os.path.join(options['out_dir'], dumpfile[dumpfile.rfind(os.path.sep)+1:])
+            if 'folded' in options['outputFormats']:   # before the pruning, since the folded stacks are the full stacks
+                writeFoldedFile(dotGraph, outfilename+'.folded', options['zipDots'])
+                profile.end_stage('write folded', nodes = len(dotGraph.pathCounts))
+            dotLines = pruneDotGraph(dotGraph, options['topPaths'], options['minThreads'], options['collapseChains'])
+            if options['topPaths'] or options['minThreads'] > 1 or options['collapseChains']:
+                profile.end_stage('prune', nodes = len(dotLines))
+            if 'dot' in options['outputFormats']:
+                writeDotFile(dotLines, dotGraph.maxNbrThreads, options['plot_threads'], options['plot_stack_id'], threadModel[0], threadModel[1], dumpfile, options['out_dir'], options['zipDots'])
+                profile.end_stage('write dot', nodes = len(dotLines))
+            graphInfo = {'dump':dumpfile, 'maxThreads':dotGraph.maxNbrThreads, 'normalThreads':threadModel[0], 'exceptionThreads':threadModel[1]}
+            for outputFormat in ['json', 'ndjson']:
+                if outputFormat in options['outputFormats']:
+                    writeJsonGraphFile(dotLines, graphInfo, outfilename+'.'+outputFormat, outputFormat == 'ndjson', options['zipDots'])
+                    profile.end_stage('write '+outputFormat, nodes = len(dotLines))
+    if options['make_wait_graph']:
+        profile.start_stage()
+        makeWaitGraph(dumpfile, waitLines, options['out_dir'])
+        profile.end_stage('wait graph', lines = len(waitLines))
+    if options['waitAnalysis']:
+        profile.start_stage()
+        waitGraph = analyzeWaitGraph(dumpfile, waitLines, options['waitTopBlockers'], options['out_dir'])
+        profile.end_stage('wait analysis', lines = len(waitLines), nodes = len(waitGraph.nodeNames))
+    if options['make_views']:
+        profile.start_stage()
+        makeViews(dumpfile, statLines, options['out_dir'])
+        profile.end_stage('views', lines = len(statLines))
+    if database is not None:
+        profile.start_stage()
+        database.end_dump(statLines)
+        profile.end_stage('database', lines = len(statLines), threads = database.nThreads)
+    if options['make_dots'] and threadModel is not None and aggregateGraph is not None:
+        aggregateGraph.end_dump(dumpfile)   # only after all other stages, a dump file that failed in one of them is discarded, see discard_dump
+    [frameHits, frameMisses] = frameCache.stats()
+    profile.set_frame_cache_stats(frameHits - frameHitsBefore, frameMisses - frameMissesBefore)
+    if options['profile']:
+        profile.printProfile()
+    return profile
+
+def processDumpFileSafely(dumpfile, options, aggregateGraph = None):
+    # one bad dump file should not stop the other dump files from being processed
+    # returns [succeeded, profile report]
+    database = None
+    try:
+        if options['database']:
+            database = DumpDatabase(options['database'], options['functionLength'], options['removeHexFromFunction'])
+        profile = processDumpFile(dumpfile, options, aggregateGraph, database)
+        return [True, profile.report()]
+    except DumpFileError as e:
+        print "ERROR: "+str(e)
+    except Exception as e:
+        print "ERROR: The file "+dumpfile+" could not be processed: "+repr(e)
+    finally:
+        if database is not None:
+            database.abort_dump()   # nothing to roll back if the dump file was loaded
+            database.close()
+    if aggregateGraph is not None:
+        aggregateGraph.discard_dump()
+    return [False, None]
+
+def processDumpFiles(dumpfiles, options, workers, aggregateGraph = None):
+    # returns [succeeded, profile report] for every dump file, in the order of the dump files
+    results = []
+    if workers > 1 and len(dumpfiles) > 1:
+        pool = multiprocessing.Pool(min(workers, len(dumpfiles)))
+        try:
+            for [output, succeeded, profileReport] in pool.imap(processDumpFileJob, [[dumpfile, options] for dumpfile in dumpfiles]):  # imap keeps the dump file order
+                sys.stdout.write(output)
+                sys.stdout.flush()
+                results.append([succeeded, profileReport])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for dumpfile in dumpfiles:
+            results.append(processDumpFileSafely(dumpfile, options, aggregateGraph))
+    return results
+
+def findTraceFiles(dumptype, newestFirst = False):
+    # indexserver trace files in cdtrace, also compressed ones, the folder is only listed once and 
+    # only the matching trace files are stat'ed (and only if they should be ordered by modification time)
+    traceDirectory = cdtrace()
+    tracePattern = 'indexserver_*'+dumptype+'*.trc'
+    isTraceFile = lambda name: any([fnmatch.fnmatch(name, tracePattern+extension) for extension in ['', '.gz', '.bz2', '.xz']])
+    if scandir is not None:
+        entries = [entry for entry in scandir(traceDirectory) if isTraceFile(entry.name)]
+        if newestFirst:
+            entries.sort(key = lambda entry: entry.stat().st_mtime, reverse = True)
+        return [entry.path for entry in entries]
+    tracefiles = [os.path.join(traceDirectory, name) for name in os.listdir(traceDirectory) if isTraceFile(name)]
+    if newestFirst:
+        tracefiles.sort(key = os.path.getmtime, reverse = True)
+    return tracefiles
+
+def watchManifestFileName(out_dir):
+    return os.path.join(out_dir, "hanadumpviewer_watch_manifest.json")
+
+def readWatchManifest(out_dir):
+    try:
+        with open(watchManifestFileName(out_dir)) as manifestfile:
+            return json.load(manifestfile)
+    except (IOError, ValueError):
+        return {}
+
+def writeWatchManifest(out_dir, manifest):
+    manifestfilename = watchManifestFileName(out_dir)
+    with open(manifestfilename+'.tmp', "w") as manifestfile:
+        json.dump(manifest, manifestfile, indent=1)
+    os.rename(manifestfilename+'.tmp', manifestfilename)   # a killed watcher never leaves a half written manifest
+
+def watchTraceDirectory(dumptype, options, workers, watchInterval, watchStablePolls):
+    # only new trace files are stat'ed, the processed trace files are only looked up in the manifest
+    dumptype = dumptype or 'dump'   # rtedump, crashdump, emergencydump, but not the always growing indexserver trace logs
+    if os.path.exists(watchManifestFileName(options['out_dir'])):
+        manifest = readWatchManifest(options['out_dir'])
+    else:   # first start, only the dump files that are written from now on are new
+        manifest = {}
+        for dumpfile in findTraceFiles(dumptype):
+            try:
+                stat = os.stat(dumpfile)
+            except OSError:
+                continue
+            manifest[dumpfile] = {'size':stat.st_size, 'mtime':stat.st_mtime, 'succeeded':None, 'processed':'existed before the watch mode was started'}
+        writeWatchManifest(options['out_dir'], manifest)
+    pending = {}   # new trace file --> [size, modification time, number polls without change]
+    print "Watching "+cdtrace()+" for new indexserver dump files ("+str(len(manifest))+" already processed or existing), stop with Ctrl-C"
+    while True:
+        readyDumpfiles = []
+        for dumpfile in sorted(findTraceFiles(dumptype)):
+            if dumpfile in manifest:
+                continue
+            try:
+                stat = os.stat(dumpfile)
+            except OSError:   # removed since the folder was listed
+                pending.pop(dumpfile, None)
+                continue
+            state = pending.get(dumpfile)
+            if state is not None and state[0] == stat.st_size and state[1] == stat.st_mtime:
+                state[2] += 1
+            else:
+                state = pending[dumpfile] = [stat.st_size, stat.st_mtime, 0]
+            if state[2] >= watchStablePolls:
+                readyDumpfiles.append(dumpfile)
+        if readyDumpfiles:
+            results = processDumpFiles(readyDumpfiles, options, workers)
+            for [dumpfile, [succeeded, profileReport]] in zip(readyDumpfiles, results):
+                [size, mtime, nPolls] = pending.pop(dumpfile)
+                manifest[dumpfile] = {'size':size, 'mtime':mtime, 'succeeded':succeeded, 'processed':time.strftime('%Y-%m-%d %H:%M:%S')}
+                if not succeeded:   # it is not tried again, it would most likely fail again
+                    print "ERROR: "+dumpfile+" could not be processed, it will not be tried again."
+            writeWatchManifest(options['out_dir'], manifest)
+            sys.stdout.flush()
+        time.sleep(watchInterval)
+
+def processDumpFileJob(job):
+    # runs in a worker process, the printouts are returned so that the main process can print them in dump file order
+    [dumpfile, options] = job
+    stdout = sys.stdout
+    sys.stdout = cStringIO.StringIO()
+    try:
+        [succeeded, profileReport] = processDumpFileSafely(dumpfile, options)
+        output = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    return [output, succeeded, profileReport]
+
 def main():
     #####################  CHECK PYTHON VERSION ###########
     if sys.version_info[0] != 2 or sys.version_info[1] != 7:
@@ -383,12 +1721,35 @@ def main():
     id_by_function = 'true'
     removeHexFromFunction = 'true'
     plot_stack_id = 'false'
+    zipDots = 'false'
+    outputFormats = 'dot'
+    topPaths = '0'
+    minThreads = '0'
+    collapseChains = 'false'
+    aggregate = 'false'
+    aggregateColor = 'threads'
+    diff = 'false'
+    diffMovers = '20'
     make_wait_graph = 'false'
+    waitAnalysis = 'false'
+    waitTopBlockers = '10'
     make_views = 'false'
     nbrDumpFiles = '0'
+    workers = '1'
+    frameCacheSize = '100000'
+    stopEarly = 'false'
+    sectionIndex = 'true'
+    threadCache = 'false'
+    threadCacheMaxSize = '1024'
+    profile = 'false'
+    watch = 'false'
+    watchInterval = '10'
+    watchStablePolls = '1'
+    profileJson = 'false'
     dumptype = ''    
     dumpfiles = []
     out_dir = os.path.join(tempfile.gettempdir(),"hanadumpviewer_output")
+    database = ''
     
     #####################  CHECK INPUT ARGUMENTS #################
     if len(sys.argv) == 1:
@@ -418,18 +1779,64 @@ def main():
         removeHexFromFunction = sys.argv[sys.argv.index('-rh') + 1]
     if '-ps' in sys.argv:
         plot_stack_id = sys.argv[sys.argv.index('-ps') + 1]
+    if '-zd' in sys.argv:
+        zipDots = sys.argv[sys.argv.index('-zd') + 1]
+    if '-of' in sys.argv:
+        outputFormats = sys.argv[sys.argv.index('-of') + 1]
+    if '-tk' in sys.argv:
+        topPaths = sys.argv[sys.argv.index('-tk') + 1]
+    if '-mt' in sys.argv:
+        minThreads = sys.argv[sys.argv.index('-mt') + 1]
+    if '-cc' in sys.argv:
+        collapseChains = sys.argv[sys.argv.index('-cc') + 1]
+    if '-wm' in sys.argv:
+        watch = sys.argv[sys.argv.index('-wm') + 1]
+    if '-wi' in sys.argv:
+        watchInterval = sys.argv[sys.argv.index('-wi') + 1]
+    if '-ws' in sys.argv:
+        watchStablePolls = sys.argv[sys.argv.index('-ws') + 1]
+    if '-dd' in sys.argv:
+        diff = sys.argv[sys.argv.index('-dd') + 1]
+    if '-dm' in sys.argv:
+        diffMovers = sys.argv[sys.argv.index('-dm') + 1]
+    if '-ag' in sys.argv:
+        aggregate = sys.argv[sys.argv.index('-ag') + 1]
+    if '-ac' in sys.argv:
+        aggregateColor = sys.argv[sys.argv.index('-ac') + 1]
     if '-mw' in sys.argv:
         make_wait_graph = sys.argv[sys.argv.index('-mw') + 1]
+    if '-wa' in sys.argv:
+        waitAnalysis = sys.argv[sys.argv.index('-wa') + 1]
+    if '-wt' in sys.argv:
+        waitTopBlockers = sys.argv[sys.argv.index('-wt') + 1]
     if '-mv' in sys.argv:
         make_views = sys.argv[sys.argv.index('-mv') + 1]
     if '-nd' in sys.argv:
         nbrDumpFiles = sys.argv[sys.argv.index('-nd') + 1]
     if '-dt' in sys.argv:
         dumptype = sys.argv[sys.argv.index('-dt') + 1]
+    if '-j' in sys.argv:
+        workers = sys.argv[sys.argv.index('-j') + 1]
+    if '-cs' in sys.argv:
+        frameCacheSize = sys.argv[sys.argv.index('-cs') + 1]
+    if '-es' in sys.argv:
+        stopEarly = sys.argv[sys.argv.index('-es') + 1]
+    if '-si' in sys.argv:
+        sectionIndex = sys.argv[sys.argv.index('-si') + 1]
+    if '-tc' in sys.argv:
+        threadCache = sys.argv[sys.argv.index('-tc') + 1]
+    if '-tm' in sys.argv:
+        threadCacheMaxSize = sys.argv[sys.argv.index('-tm') + 1]
+    if '-pf' in sys.argv:
+        profile = sys.argv[sys.argv.index('-pf') + 1]
+    if '-pj' in sys.argv:
+        profileJson = sys.argv[sys.argv.index('-pj') + 1]
     if '-df' in sys.argv:
         dumpfiles = [x for x in sys.argv[  sys.argv.index('-df') + 1   ].split(',')]
     if '-od' in sys.argv:
         out_dir = sys.argv[sys.argv.index('-od') + 1]
+    if '-db' in sys.argv:
+        database = sys.argv[sys.argv.index('-db') + 1]
 
     ############# OUTPUT DIRECTORY #########
     out_dir = out_dir.replace(" ","_").replace(".","_")
@@ -455,8 +1862,50 @@ def main():
     if plot_stack_id and id_by_function:
         print "INPUT ERROR: both -ps and -if cannot be true together. Please see --help for more information"
         os._exit(1)
+    ### zipDots, -zd
+    zipDots = checkAndConvertBooleanFlag(zipDots, "-zd")
+    ### outputFormats, -of
+    outputFormats = outputFormats.split(',')
+    for outputFormat in outputFormats:
+        if not outputFormat in ['dot', 'folded', 'json', 'ndjson']:
+            print "INPUT ERROR: -of must be a list of the formats dot, folded, json and ndjson. Please see --help for more information."
+            os._exit(1)
+    ### topPaths, -tk
+    if not is_integer(topPaths) or int(topPaths) < 0:
+        print "INPUT ERROR: -tk must be a non-negative integer. Please see --help for more information."
+        os._exit(1)
+    topPaths = int(topPaths)
+    if topPaths and plot_threads:
+        print "INPUT ERROR: -tk cannot be used if -pt is true. Please see --help for more information."
+        os._exit(1)
+    ### minThreads, -mt
+    if not is_integer(minThreads) or int(minThreads) < 0:
+        print "INPUT ERROR: -mt must be a non-negative integer. Please see --help for more information."
+        os._exit(1)
+    minThreads = int(minThreads)
+    ### collapseChains, -cc
+    collapseChains = checkAndConvertBooleanFlag(collapseChains, "-cc")
+    ### aggregate, -ag
+    aggregate = checkAndConvertBooleanFlag(aggregate, "-ag")
+    if aggregate and plot_threads:
+        print "INPUT ERROR: -ag and -pt cannot both be true. Please see --help for more information."
+        os._exit(1)
+    ### aggregateColor, -ac
+    if aggregateColor not in ('threads', 'dumps'):
+        print "INPUT ERROR: -ac must be either 'threads' or 'dumps'. Please see --help for more information."
+        os._exit(1)
+    if '-ac' in sys.argv and not aggregate:
+        print "INPUT ERROR: -ac can only be used if -ag is true. Please see --help for more information."
+        os._exit(1)
     ### make_wait_graph, -mw
     make_wait_graph = checkAndConvertBooleanFlag(make_wait_graph, "-mw")
+    ### waitAnalysis, -wa
+    waitAnalysis = checkAndConvertBooleanFlag(waitAnalysis, "-wa")
+    ### waitTopBlockers, -wt
+    if not is_integer(waitTopBlockers) or int(waitTopBlockers) < 0:
+        print "INPUT ERROR: -wt must be a non-negative integer. Please see --help for more information."
+        os._exit(1)
+    waitTopBlockers = int(waitTopBlockers)
     ### make_views, -mv
     make_views = checkAndConvertBooleanFlag(make_views, "-mv")
     ### nbrDumpFiles, -nd 
@@ -464,9 +1913,76 @@ def main():
         print "INPUT ERROR: -nd must be an integer. Please see --help for more information."
         os._exit(1)
     nbrDumpFiles = int(nbrDumpFiles)
+    ### workers, -j
+    if not is_integer(workers) or int(workers) < 1:
+        print "INPUT ERROR: -j must be a positive integer. Please see --help for more information."
+        os._exit(1)
+    workers = int(workers)
+    if aggregate and workers > 1:
+        print "INPUT ERROR: -ag and -j cannot be used together. Please see --help for more information."
+        os._exit(1)
+    ### frameCacheSize, -cs
+    if not is_integer(frameCacheSize) or int(frameCacheSize) < 0:
+        print "INPUT ERROR: -cs must be a non-negative integer. Please see --help for more information."
+        os._exit(1)
+    frameCacheSize = int(frameCacheSize)
+    ### stopEarly, -es
+    stopEarly = checkAndConvertBooleanFlag(stopEarly, "-es")
+    ### sectionIndex, -si
+    sectionIndex = checkAndConvertBooleanFlag(sectionIndex, "-si")
+    ### threadCache, -tc
+    threadCache = checkAndConvertBooleanFlag(threadCache, "-tc")
+    ### threadCacheMaxSize, -tm
+    if not is_integer(threadCacheMaxSize) or int(threadCacheMaxSize) < 0:
+        print "INPUT ERROR: -tm must be a non-negative integer. Please see --help for more information."
+        os._exit(1)
+    threadCacheMaxSize = int(threadCacheMaxSize)
+    ### profile, -pf
+    profile = checkAndConvertBooleanFlag(profile, "-pf")
+    ### profileJson, -pj
+    profileJson = checkAndConvertBooleanFlag(profileJson, "-pj")
+    if profileJson and not profile:
+        print "INPUT ERROR: -pj can only be true if -pf is true. Please see --help for more information."
+        os._exit(1)
+    ### diff, -dd
+    diff = checkAndConvertBooleanFlag(diff, "-dd")
+    if diff and (plot_threads or aggregate or topPaths or minThreads > 1 or collapseChains or workers > 1):
+        print "INPUT ERROR: -dd cannot be used together with -pt, -ag, -tk, -mt, -cc or -j. Please see --help for more information."
+        os._exit(1)
+    if diff and (len(dumpfiles) != 2 or not make_dots):
+        print "INPUT ERROR: -dd needs exactly two dump files in -df and -md true. Please see --help for more information."
+        os._exit(1)
+    ### diffMovers, -dm
+    if not is_integer(diffMovers) or int(diffMovers) < 0:
+        print "INPUT ERROR: -dm must be a non-negative integer. Please see --help for more information."
+        os._exit(1)
+    diffMovers = int(diffMovers)
+    ### database, -db
+    if database and sqlite3 is None:
+        print "INPUT ERROR: -db needs the sqlite3 module, which is not available in this Python. Please see --help for more information."
+        os._exit(1)
+    if database and not os.path.isdir(os.path.dirname(os.path.abspath(database))):
+        print "INPUT ERROR: the folder of the -db database file does not exist. Please see --help for more information."
+        os._exit(1)
+    database = os.path.abspath(database) if database else ''
+    ### watch, -wm
+    watch = checkAndConvertBooleanFlag(watch, "-wm")
+    if watch and (dumpfiles or nbrDumpFiles or aggregate or profileJson):
+        print "INPUT ERROR: -wm cannot be used together with -df, -nd, -ag or -pj. Please see --help for more information."
+        os._exit(1)
+    ### watchInterval, -wi
+    if not is_integer(watchInterval) or int(watchInterval) < 1:
+        print "INPUT ERROR: -wi must be a positive integer. Please see --help for more information."
+        os._exit(1)
+    watchInterval = int(watchInterval)
+    ### watchStablePolls, -ws
+    if not is_integer(watchStablePolls) or int(watchStablePolls) < 0:
+        print "INPUT ERROR: -ws must be a non-negative integer. Please see --help for more information."
+        os._exit(1)
+    watchStablePolls = int(watchStablePolls)
     ### dumptype, -dt
-    if dumptype and not nbrDumpFiles:
-        print "INPUT ERROR: -dt can only be specified if -nd is. Please see --help for more information."
+    if dumptype and not nbrDumpFiles and not watch:
+        print "INPUT ERROR: -dt can only be specified if -nd or -wm is. Please see --help for more information."
         os._exit(1)
     ### dumpfiles, -df 
     if dumpfiles and nbrDumpFiles:
@@ -475,23 +1991,54 @@ def main():
 
     ############# DUMPFILES FROM CDTRACE ###################
     if nbrDumpFiles:
-        dumpfiles = subprocess.check_output('ls '+cdtrace()+'/indexserver_*'+dumptype+'*.trc | head -'+str(nbrDumpFiles), shell=True).splitlines(1)
-        dumpfiles = [dumpfile.strip('\n') for dumpfile in dumpfiles]
+        dumpfiles = findTraceFiles(dumptype, newestFirst = True)[:nbrDumpFiles]
     
     ################ START #################
-    if make_dots:    
-        for dumpfile in dumpfiles:
-            stackLines = readSectionLines(dumpfile, '[STACK_SHORT]')
-            if stackLines:
-                [threads, nNormalThreads, nExceptThreads] = createThreads(stackLines)          
-                [dotLines, maxNbrThreads] = createDotLines(threads, plot_threads, functionLength, removeHexFromFunction, id_by_function)          
-                writeDotFile(dotLines, maxNbrThreads, plot_threads, plot_stack_id, nNormalThreads, nExceptThreads, dumpfile, out_dir) 
-    if make_wait_graph:
-        for dumpfile in dumpfiles:
-            makeWaitGraph(dumpfile, out_dir)
-    if make_views:
-        for dumpfile in dumpfiles:
-            makeViews(dumpfile, out_dir)
+    options = {'make_dots':make_dots, 'plot_threads':plot_threads, 'functionLength':functionLength, 'removeHexFromFunction':removeHexFromFunction, 
+               'id_by_function':id_by_function, 'plot_stack_id':plot_stack_id, 'zipDots':zipDots, 'outputFormats':outputFormats, 
+               'topPaths':topPaths, 'minThreads':minThreads, 'collapseChains':collapseChains, 'make_wait_graph':make_wait_graph, 
+               'waitAnalysis':waitAnalysis, 'waitTopBlockers':waitTopBlockers, 'make_views':make_views, 'out_dir':out_dir,
+               'frameCacheSize':frameCacheSize, 'stopEarly':stopEarly, 'sectionIndex':sectionIndex,
+               'threadCache':threadCache, 'threadCacheMaxSize':threadCacheMaxSize, 'profile':profile, 'database':database}
+    if watch:
+        try:
+            watchTraceDirectory(dumptype, options, workers, watchInterval, watchStablePolls)
+        except KeyboardInterrupt:
+            print "Watch mode was stopped"
+        return
+    aggregateGraph = DotGraph(plot_threads, functionLength, removeHexFromFunction, id_by_function, aggregated = True, recordPaths = topPaths > 0 or 'folded' in outputFormats, recordEdges = diff) if (aggregate or diff) and make_dots else None
+    results = processDumpFiles(dumpfiles, options, workers, aggregateGraph)
+    nFailedDumpFiles = len([succeeded for [succeeded, profileReport] in results if not succeeded])
+    profileReports = [profileReport for [succeeded, profileReport] in results if succeeded]
+    if diff:
+        dumpIndices = diffDumpIndices(aggregateGraph, dumpfiles) if not nFailedDumpFiles and len(aggregateGraph.dumpNames) == 2 else None
+        if dumpIndices is not None:
+            writeDiffDotFile(aggregateGraph, dumpIndices, plot_stack_id, diffMovers, out_dir, zipDots)
+        else:
+            print "WARNING: Both dump files are needed for -dd, so no diff stack graph was created."
+    elif aggregateGraph is not None:
+        if any([dotLine.nbrDumps() for dotLine in aggregateGraph.dotLines]):
+            outfilename = os.path.join(out_dir, "aggregated_stack_graph")
+            if 'folded' in outputFormats:
+                writeFoldedFile(aggregateGraph, outfilename+'.folded', zipDots)
+            dotLines = pruneDotGraph(aggregateGraph, topPaths, minThreads, collapseChains)
+            if 'dot' in outputFormats:
+                writeAggregatedDotFile(aggregateGraph, dotLines, aggregateColor == 'dumps', plot_stack_id, out_dir, zipDots)
+            dotLines = [dotLine for dotLine in dotLines if dotLine.nbrDumps()]
+            graphInfo = {'dumps':[dumpName.split('/')[-1] for dumpName in aggregateGraph.dumpNames], 'maxThreads':max([dotLine.totalThreads() for dotLine in dotLines])}
+            for outputFormat in ['json', 'ndjson']:
+                if outputFormat in outputFormats:
+                    writeJsonGraphFile(dotLines, graphInfo, outfilename+'.'+outputFormat, outputFormat == 'ndjson', zipDots, aggregateGraph.dumpNames)
+        else:
+            print "WARNING: No stack processes were found in the dump files, so no aggregated stack graph was created."
+    if profileJson:
+        profilefilename = os.path.join(out_dir, "hanadumpviewer_profile.json")
+        with open(profilefilename, "w") as profilefile:
+            json.dump({'workers':workers, 'dumpfiles':profileReports}, profilefile, indent=1)
+        print "File "+profilefilename+" was created"
+    if nFailedDumpFiles:
+        print "ERROR: "+str(nFailedDumpFiles)+" of "+str(len(dumpfiles))+" dump files could not be processed."
+        os._exit(1)
     
               
 if __name__ == '__main__':